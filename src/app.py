@@ -15,58 +15,115 @@ builtins.print = quiet_print
 
 
 import argparse
+import contextlib
 import sys
-from datetime import datetime, timedelta
-from typing import Tuple
-
-from peewee import fn
-
-import pretty_print
-from calendar_utils import daterange, get_iso_week_dates, get_week_string
-from db_config import db
-from env import ARCHIVE_DIR, STATUSBAR_FILE
-from harvest import pull, pull_weekly_harvest_hours, push_task
+from itertools import groupby
+from datetime import date, datetime, timedelta
+from typing import List, Tuple
+
+import harvest_hours
+import outbox
+import rollups
+import tracing
+from calendar_utils import (
+    daterange,
+    get_iso_week_dates,
+    iso_week_range,
+    today_range,
+)
+from catalog import CatalogClient, CatalogProject, CatalogTask, get_catalog
+from client import get_command
+from db_config import db, session
+from env import ARCHIVE_DIR, ASSIGN_PICKER, HARVEST_AUTO_FLUSH
+from migrations import migrate
+from statusbar import update_statusbar
 from model import (
     DailyTarget,
+    DurationRollup,
     HarvestClient,
-    HarvestMeta,
     HarvestProject,
     HarvestTask,
+    HarvestUpload,
+    HarvestWeekHours,
     LogHistory,
+    OutboxEntry,
     Preset,
+    SyncState,
     Task,
+    TaskName,
     User,
 )
-from task_utils import get_last_task, is_task_running, start_task, stop_task
+from task_utils import (
+    assert_not_uploaded,
+    get_last_task,
+    get_running_task,
+    get_tasks_in_range,
+    filter_tasks,
+    is_task_running,
+    queue_for_upload,
+    start_task,
+    stop_task,
+)
 from utils import (
+    ask,
     fzf,
+    fzf_with_query,
+    ignore_broken_pipe,
+    pager,
     get_short_uuid,
     get_task_lengths_in_mins,
 )
 
 
-def get_weeks_tasks(KW=None):
-    if KW:
-        this_week = str(KW).lstrip("0")
-    else:
-        this_week = str(datetime.today().date().isocalendar()[1])
-    this_year = str(datetime.today().date().isocalendar()[0])
-    start_date, end_date = get_iso_week_dates(this_year, this_week)
-    tasks = (
-        Task.select()
-        .where((Task.start_time >= start_date) & (Task.start_time <= end_date))
-        .order_by(Task.start_time)
+def get_weeks_tasks(KW=None, year=None):
+    today = datetime.today().date().isocalendar()
+    week = int(KW) if KW else today[1]
+    return get_tasks_in_range(iso_week_range(year or today[0], week))
+
+
+def pick_task_name() -> Tuple[str, TaskName | None]:
+    from suggestions import get_suggestions
+
+    suggestions = get_suggestions()
+    if not suggestions:
+        return ask("Name? "), None
+    query, index = fzf_with_query(
+        {i: x.name for i, x in enumerate(suggestions)}, "Name?"
+    )
+    if index is not None:
+        return suggestions[int(index)].name, suggestions[int(index)]
+    # A typed name can still be a known one
+    return query, next((x for x in suggestions if x.name == query), None)
+
+
+def start_new_task():
+    name, suggestion = pick_task_name()
+    harvestTask = None
+    if suggestion and suggestion.projectId:
+        harvestTask = get_catalog().tasks.get((suggestion.projectId, suggestion.taskId))
+    if not harvestTask:
+        start_task(taskName=name, stopPrevious=True)
+        assign_task()
+        return
+    # Same assignment as the last time, no popups
+    start_task(
+        taskId=harvestTask.taskId,
+        projectId=harvestTask.project.projectId,
+        taskName=name,
+        stopPrevious=True,
+    )
+    print(
+        f"Attributed to {harvestTask.client.name}/{harvestTask.project.name}/"
+        f"{harvestTask.name} like last time, change it with `task assign`."
     )
-    return tasks
 
 
-def resume_task():
+def resume_task(tasks: List[Task] | None = None):
     assert not is_task_running(), "There's currently a task running!"
 
-    today = datetime.today()
-    tasks = Task.select().where(
-        fn.strftime("%Y-%m-%d", Task.start_time) == today.strftime("%Y-%m-%d")
-    )
+    if tasks is None:
+        tasks = get_tasks_in_range(today_range())
+    assert tasks, "No tasks to resume"
 
     uuid = fzf({task.uuid: task.name for task in tasks}, prompt="Resume task?")
     task = [task for task in tasks if task.uuid == uuid][0]
@@ -78,13 +135,18 @@ def extend_task():
     assert not is_task_running(), "There's currently a task running!"
 
     task = get_last_task()
+    assert_not_uploaded(task)
+    rollups.remove_task(task)
     task.end_time = None
     task.save()
+    # Queued again when it is stopped
+    OutboxEntry.delete().where(OutboxEntry.uuid == task.uuid).execute()
     print(f'Set "{task.name}" to running.')
 
 
 def rename_task(task_name):
     task = get_last_task()
+    assert_not_uploaded(task)
     old_name = task.name
     task.name = task_name
     task.save()
@@ -141,39 +203,87 @@ def show_unlogged_tasks():
         print(show_task(task, showDate=True))
 
 
-def show_all_tasks():
-    print("All recorded tasks:")
-    for task in Task.select():
+def show_all_tasks(
+    since=None, until=None, project=None, limit=None, offset=None, usePager=True
+):
+    tasks = filter_tasks(Task.select().order_by(Task.start_time), since, until, project)
+    if limit is not None:
+        tasks = tasks.limit(limit)
+    if offset:
+        tasks = tasks.offset(offset)
+    with pager(usePager and not QUIET) as out:
+        print("All recorded tasks:", file=out)
+        for task in tasks.iterator():
+            print(show_task(task, showDate=True), file=out)
+
+
+def search_task_list(args):
+    from search import get_distinct_tasks, search_tasks
+
+    tasks = search_tasks(
+        " ".join(args.query), args.since, args.until, args.project, args.limit
+    )
+    if args.resume:
+        resume_task(get_distinct_tasks(tasks))
+        update_statusbar()
+        return
+    if not tasks:
+        print("No tasks found.")
+        return
+    for task in tasks:
         print(show_task(task, showDate=True))
 
 
-def unlog_tasks():
-    lastLoggedTasksHistory = LogHistory.select()
-    if not lastLoggedTasksHistory:
-        print("No history of logging found - only one undo level is supported.")
+def export_task_list(args):
+    from export import export_tasks
+
+    filters = {
+        "since": args.since,
+        "until": args.until,
+        "logged": args.logged,
+        "project": args.project,
+    }
+    if not args.output:
+        with ignore_broken_pipe():
+            export_tasks(sys.stdout, args.format, **filters)
         return
+    with open(args.output, "w", newline="") as f:
+        count = export_tasks(f, args.format, **filters)
+    print(f"Exported {count} tasks to {args.output}")
+
+
+def unlog_tasks():
+    with db.atomic():
+        lastLoggedTasks = list(
+            Task.select().join(LogHistory, on=(Task.uuid == LogHistory.uuid))
+        )
+        if not lastLoggedTasks:
+            print("No history of logging found - only one undo level is supported.")
+            return
+        Task.update(is_logged=False).where(
+            Task.uuid.in_(LogHistory.select(LogHistory.uuid))
+        ).execute()
+        LogHistory.delete().execute()
     print(f"Reset the following tasks' log status:")
-    for logEntry in lastLoggedTasksHistory:
-        task = Task.get(logEntry.uuid)
-        task.is_logged = False
-        task.save()
+    for task in lastLoggedTasks:
         print(f"{task.uuid}: {task.name}")
-    LogHistory.delete().execute()
 
 
 def log_tasks():
-    unloggedTasks = Task.select().where(
-        (Task.is_logged == False) & (Task.end_time.is_null(False))
-    )
-    if not unloggedTasks:
-        print("No unlogged tasks found.")
-        return
+    loggable = (Task.is_logged == False) & (Task.end_time.is_null(False))
+    with db.atomic():
+        unloggedTasks = list(Task.select().where(loggable))
+        if not unloggedTasks:
+            print("No unlogged tasks found.")
+            return
+        LogHistory.delete().execute()
+        LogHistory.insert_from(
+            Task.select(Task.uuid).where(loggable), fields=[LogHistory.uuid]
+        ).execute()
+        Task.update(is_logged=True).where(loggable).execute()
     print("Marked the following tasks as logged:")
-    LogHistory.delete().execute()
     for task in unloggedTasks:
         task.is_logged = True
-        task.save()
-        LogHistory.create(uuid=task.uuid)
         print(show_task(task))
 
 
@@ -195,15 +305,14 @@ def show_db():
     show_single_db("Clients", HarvestClient)
     show_single_db("Harvest Tasks", HarvestTask)
     show_single_db("Last logged", LogHistory)
-    show_single_db("Logged hours", HarvestMeta)
+    show_single_db("Logged hours", HarvestWeekHours)
+    show_single_db("Outbox", OutboxEntry)
 
 
 def show_today_tasks():
     today = datetime.today()
-    todayTasks = Task.select().where(
-        fn.strftime("%Y-%m-%d", Task.start_time) == today.strftime("%Y-%m-%d")
-    )
-    total_mins = get_task_lengths_in_mins(todayTasks)
+    todayTasks = get_tasks_in_range(today_range())
+    total_mins = rollups.get_tracked_minutes(today_range())
     mins = total_mins % 60
     hours = total_mins // 60
     print(today.strftime(f"Tasks on %a, %-d.%-m. ({hours:02}:{mins:02} spent):"))
@@ -211,26 +320,13 @@ def show_today_tasks():
         print(show_task(task, showWeekDay=False))
 
 
-def update_statusbar():
-    if not is_task_running():
-        output = ""
-    else:
-        task = get_last_task()
-        output = task.name + " since " + task.start_time.strftime("%-H:%M")
-    with open(STATUSBAR_FILE, "w") as f:
-        f.write(output)
-
-
-def get_hour_overview(tasks, KW: str | None = None) -> str:
-    this_week = get_week_string(KW)
-    this_year = str(datetime.today().date().isocalendar()[0])
+def get_hour_overview(year: int, week: int, tasks: List[Task], hours_harvest) -> str:
     hours_local = get_task_lengths_in_mins(tasks) / 60
-    hours_harvest = HarvestMeta.select().limit(1)[0].hours
     hours_unlogged = (
-        get_task_lengths_in_mins(get_unlogged_tasks(includeRunning=True)) / 60
+        get_task_lengths_in_mins([task for task in tasks if not task.is_logged]) / 60
     )
     output = ""
-    output += f"# KW {this_week} / {this_year}\n\n"
+    output += f"# KW {week:02} / {year}\n\n"
     output += f"\t{hours_local:.2f} tracked locally\n"
     output += f"\t{hours_harvest:.2f} in Harvest\n"
     output += f"\t{hours_unlogged:.2f} unlogged locally\n"
@@ -254,89 +350,199 @@ def get_tasks_overview(tasks):
 
 
 def print_day_summary():
-    start_date = datetime.now().date()
-    end_date = datetime.now().date() + timedelta(days=1)
-    tasksToday = (
-        Task.select()
-        .where((Task.start_time >= start_date) & (Task.start_time <= end_date))
-        .order_by(Task.start_time)
-    )
-    tasksUnlogged = get_unlogged_tasks(includeRunning=True)
-    pretty_print.show_daily_summary(tasksToday, tasksUnlogged)
+    tasksToday = get_tasks_in_range(today_range())
+    import pretty_print
+
+    pretty_print.show_daily_summary(tasksToday, rollups.get_unlogged_minutes())
 
 
-def get_week_overview(KW=None):
-    weekTasks = get_weeks_tasks(KW)
-    output = get_hour_overview(weekTasks, KW)
-    output += get_tasks_overview(weekTasks)
+def render_week(year: int, week: int, tasks: List[Task], hours_harvest) -> str:
+    output = get_hour_overview(year, week, tasks, hours_harvest)
+    output += get_tasks_overview(tasks)
     return output
 
 
-def archive_week(KW=None):
-    CURRENT_WEEK_FILE = ARCHIVE_DIR / f"KW_{get_week_string(KW)}.md"
+def get_week_overview(KW=None, year=None, blocking=False):
+    today = datetime.today().date().isocalendar()
+    year = int(year or today[0])
+    week = int(KW or today[1])
+    weekTasks = list(get_weeks_tasks(week, year))
+    hours = harvest_hours.get_week_hours(year, week, blocking=blocking)
+    return render_week(year, week, weekTasks, hours)
+
+
+def get_archive_file(year: int, week: int):
+    return ARCHIVE_DIR / f"KW_{year}_{week:02}.md"
+
+
+def write_if_changed(path, content: str) -> bool:
+    data = content.encode("utf-8")
+    try:
+        if path.read_bytes() == data:
+            return False
+    except FileNotFoundError:
+        pass
+    tmpPath = path.with_name(f".{path.name}.tmp")
+    tmpPath.write_bytes(data)
+    tmpPath.replace(path)
+    return True
+
+
+def archive_week(KW=None, year=None):
+    today = datetime.today().date().isocalendar()
+    year = int(year or today[0])
+    week = int(KW or today[1])
     ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
-    with open(CURRENT_WEEK_FILE, "w") as f:
-        f.write(get_week_overview(KW))
-    print(f"Wrote week to {CURRENT_WEEK_FILE}")
+    path = get_archive_file(year, week)
+    if write_if_changed(path, get_week_overview(week, year, blocking=True)):
+        print(f"Wrote week to {path}")
+    else:
+        print(f"{path} is up to date")
+
+
+def archive_weeks(first: harvest_hours.Week | None, last: harvest_hours.Week | None):
+    # One query for the whole range, weeks without tasks get no file
+    if first:
+        start, _ = iso_week_range(*first)
+    else:
+        firstTask = Task.select().order_by(Task.start_time).first()
+        if not firstTask:
+            print("No tasks to archive.")
+            return
+        start = firstTask.start_time
+    _, end = iso_week_range(*(last or datetime.today().date().isocalendar()[:2]))
+    tasks = get_tasks_in_range((start, end))
+    weeks = {
+        week: list(weekTasks)
+        for week, weekTasks in groupby(
+            tasks, key=lambda task: task.start_time.isocalendar()[:2]
+        )
+    }
+    if not weeks:
+        print("No tasks to archive.")
+        return
+    hours = harvest_hours.get_weeks_hours(list(weeks), blocking=True)
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    written = 0
+    for (year, week), weekTasks in weeks.items():
+        content = render_week(year, week, weekTasks, hours[(year, week)])
+        written += write_if_changed(get_archive_file(year, week), content)
+    print(
+        f"Wrote {written} of {len(weeks)} weeks to {ARCHIVE_DIR}, "
+        f"{len(weeks) - written} were up to date."
+    )
 
 
 def show_status(quiet: bool = False) -> bool:
-    if not is_task_running():
+    return print_status(get_running_task())
+
+
+def print_status(task: Task | None) -> bool:
+    if not task:
         print("No task currently running!")
         return False
-    task = get_last_task()
     diff_mins = int(((datetime.now() - task.start_time).total_seconds() % 3600) // 60)
     start_time = task.start_time.strftime("%-H:%M")
     print(f'"{task.name}" running since {start_time} ({diff_mins} mins).')
     return True
 
 
-def assign_task(uuid=None):
-    clientId = fzf({x.clientId: x.name for x in HarvestClient.select()}, "Client?")
-    client = HarvestClient.select().where(HarvestClient.clientId == clientId)[0]
-    if len(client.projects) == 1:
-        print(f'Only 1 project, selecting "{client.projects[0].name}"')
-        projectId = client.projects[0].projectId
+def select_harvest_task() -> Tuple[CatalogClient, CatalogProject, CatalogTask]:
+    if ASSIGN_PICKER == "steps":
+        return select_harvest_task_in_steps()
+    # The whole catalog in one `fzf` popup
+    tasks = get_catalog().sortedTasks
+    assert tasks, "No Harvest tasks, run `task pull` first"
+    if len(tasks) == 1:
+        harvestTask = tasks[0]
+        print(f'Only 1 task, selecting "{harvestTask.name}"')
+    else:
+        index = fzf(
+            {
+                i: f"{x.client.name} / {x.project.name} / {x.name}"
+                for i, x in enumerate(tasks)
+            },
+            "Task?",
+        )
+        harvestTask = tasks[int(index)]
+    return harvestTask.client, harvestTask.project, harvestTask
+
+
+def select_harvest_task_in_steps() -> Tuple[CatalogClient, CatalogProject, CatalogTask]:
+    clients = get_catalog().clients
+    clientId = fzf({key: x.name for key, x in clients.items()}, "Client?")
+    client = clients[int(clientId)]
+    projects = {x.projectId: x for x in client.projects}
+    if len(projects) == 1:
+        project = next(iter(projects.values()))
+        print(f'Only 1 project, selecting "{project.name}"')
     else:
-        projectId = fzf({x.projectId: x.name for x in client.projects}, "Project?")
-    project = HarvestProject.select().where(HarvestProject.projectId == projectId)[0]
-    if len(project.tasks) == 1:
-        print(f'Only 1 task, selecting "{project.tasks[0].name}"')
-        taskId = project.tasks[0].taskId
+        projectId = fzf({key: x.name for key, x in projects.items()}, "Project?")
+        project = projects[int(projectId)]
+    tasks = {x.taskId: x for x in project.tasks}
+    if len(tasks) == 1:
+        harvestTask = next(iter(tasks.values()))
+        print(f'Only 1 task, selecting "{harvestTask.name}"')
     else:
-        taskId = fzf({x.taskId: x.name for x in project.tasks}, "Task?")
-    harvestTask = HarvestTask.select().where(HarvestTask.taskId == taskId)[0]
+        taskId = fzf({key: x.name for key, x in tasks.items()}, "Task?")
+        harvestTask = tasks[int(taskId)]
+    return client, project, harvestTask
+
+
+def assign_task(uuid=None):
     if uuid:
         task = Task.get(uuid)
     else:
         task = get_last_task()
+    assert_not_uploaded(task)
+    client, project, harvestTask = select_harvest_task()
 
-    task.projectId = projectId
-    task.taskId = taskId
+    rollups.remove_task(task)
+    task.projectId = project.projectId
+    task.taskId = harvestTask.taskId
     task.save()
+    rollups.add_task(task)
 
     print(
         f'Attributed "{task.name}" to {client.name}/{project.name}/{harvestTask.name}.'
     )
 
 
-def push_unlogged_tasks():
-    unloggedTasks = get_unlogged_tasks()
-    if not unloggedTasks:
+def push_unlogged_tasks() -> bool:
+    # Runs after the command's transaction: the outbox commits its claims
+    # before uploading
+    tasks, errors = outbox.flush(force=True, undoable=True)
+    if not tasks:
         print("No tasks to be uploaded.")
-        return
-    LogHistory.delete().execute()
-    for task in unloggedTasks:
-        push_task(task)
-        task.is_logged = True
-        task.save()
-        LogHistory.create(uuid=task.uuid)
-    pull_weekly_harvest_hours()
+        return True
+    for task in tasks:
+        if task.uuid in errors:
+            print(f'Failed to push "{task.name}": {errors[task.uuid]}')
+    if errors:
+        print(f"Pushed {len(tasks) - len(errors)} tasks, {len(errors)} failed.")
+        return False
     print("Successfully pushed all unlogged tasks.")
+    return True
+
+
+def show_outbox():
+    entries = list(outbox.get_entries())
+    if not entries:
+        print("No tasks waiting for upload.")
+        return
+    for entry in entries:
+        if entry.attempts == 0:
+            state = "queued"
+        else:
+            state = f"{entry.attempts} attempts, next {entry.next_attempt_at:%H:%M}"
+        print(f"{entry.uuid}: {entry.task.name} ({state})")
+        if entry.last_error:
+            print(f"    {entry.last_error}")
 
 
 def split_task(newName: str):
     current = get_last_task()
+    assert_not_uploaded(current)
     if is_task_running():
         endTimeCurrent = datetime.now()
         endTimeNew = None
@@ -344,13 +550,15 @@ def split_task(newName: str):
         endTimeCurrent = current.end_time
         endTimeNew = current.end_time
     runtime = int(((endTimeCurrent - current.start_time).total_seconds()) / 60)
-    mins = int(input("How many minutes of the last task should be re-assigned?"))
+    mins = int(ask("How many minutes of the last task should be re-assigned?"))
     assert mins < runtime, (
         f"Need to provide a split lower than the current runtime ({mins} mins)"
     )
     splitTime = current.start_time + timedelta(minutes=mins)
+    rollups.remove_task(current)
     current.end_time = splitTime
     current.save()
+    rollups.add_task(current)
     new_task_data = {
         "uuid": get_short_uuid(),
         "start_time": splitTime,
@@ -360,30 +568,60 @@ def split_task(newName: str):
         "taskId": None,
         "projectId": None,
     }
-    Task.create(**new_task_data)
+    newTask = Task.create(**new_task_data)
+    rollups.add_task(newTask)
+    # Like `stop`, running tasks are queued when they are stopped
+    queue_for_upload([current, newTask])
     assign_task()
 
 
 def setup():
-    with db:
-        db.create_tables(
-            [
-                HarvestClient,
-                Task,
-                LogHistory,
-                HarvestMeta,
-                HarvestProject,
-                HarvestTask,
-                Preset,
-                User,
-                DailyTarget,
-            ]
-        )
-        pull()
+    # Runs in the transaction of `run_command`, Harvest data is pulled after it
+    db.create_tables(
+        [
+            HarvestClient,
+            Task,
+            LogHistory,
+            HarvestWeekHours,
+            HarvestProject,
+            HarvestTask,
+            HarvestUpload,
+            Preset,
+            User,
+            DailyTarget,
+            DurationRollup,
+            SyncState,
+            OutboxEntry,
+            TaskName,
+        ]
+    )
+    migrate(force=True)
+
+
+def rebuild_rollups():
+    mismatches = rollups.rebuild()
+    if mismatches:
+        print(f"Rebuilt rollups, fixed {mismatches} mismatching rows.")
+    else:
+        print("Rebuilt rollups, all rows matched.")
+
+
+# `releaseLock`: started by `refresh_in_background`, which took the lock
+def refresh_hours(weeks: List[str], releaseLock: bool = False):
+    from harvest import pull_harvest_hours
+
+    try:
+        if weeks:
+            pull_harvest_hours([harvest_hours.parse_week(week) for week in weeks])
+        else:
+            pull_harvest_hours([datetime.today().date().isocalendar()[:2]])
+    finally:
+        if releaseLock:
+            harvest_hours.release_refresh_lock()
 
 
 def get_time_from_user() -> Tuple[int, int]:
-    inp = input("In format %H:%M, which time? ").split(":")
+    inp = ask("In format %H:%M, which time? ").split(":")
     return int(inp[0]), int(inp[1])
 
 
@@ -391,6 +629,7 @@ def edit_task():
     tasks = get_weeks_tasks()
     uuid = fzf({task.uuid: show_task(task) for task in tasks}, prompt="Which task?")
     task = [task for task in tasks if task.uuid == uuid][0]
+    assert_not_uploaded(task)
     field = fzf(
         {
             "name": "name",
@@ -400,12 +639,13 @@ def edit_task():
         },
         "Which field to edit?",
     )
+    if field == "assignment":
+        assign_task(uuid)
+        return
+    rollups.remove_task(task)
     match field:
-        case "assignment":
-            assign_task(uuid)
-            return
         case "name":
-            task.name = input("New name? ")
+            task.name = ask("New name? ")
         case "start time":
             hour, minute = get_time_from_user()
             task.start_time = task.start_time.replace(hour=hour)
@@ -417,6 +657,7 @@ def edit_task():
         case _:
             raise ValueError("Something went wrong.")
     task.save()
+    rollups.add_task(task)
     update_statusbar()
 
 
@@ -438,7 +679,7 @@ def add_old_task():
     for single_date in daterange(start_date, end_date):
         week[single_date.strftime(weekdayformat)] = weekDayMap[single_date.weekday()]
     weekday = fzf(week, "Select weekday:")
-    name = input("Name? ")
+    name = ask("Name? ")
     print("Enter start time:")
     hourStart, minuteStart = get_time_from_user()
     start_time = datetime.strptime(weekday, weekdayformat) + timedelta(
@@ -458,8 +699,11 @@ def add_old_task():
         "taskId": None,
         "projectId": None,
     }
-    Task.create(**task_data)
-    assign_task()
+    task = Task.create(**task_data)
+    rollups.add_task(task)
+    queue_for_upload([task])
+    # Not necessarily the last task
+    assign_task(task.uuid)
 
 
 def delete_task():
@@ -468,6 +712,8 @@ def delete_task():
         {task.uuid: show_task(task) for task in tasks}, prompt="Which task to delete?"
     )
     task = Task.select().where(Task.uuid == uuid).limit(1)[0]
+    assert_not_uploaded(task)
+    rollups.remove_task(task)
     task.delete_instance()
 
 
@@ -480,22 +726,9 @@ def delete_preset():
 
 
 def add_preset():
-    clientId = fzf({x.clientId: x.name for x in HarvestClient.select()}, "Client?")
-    client = HarvestClient.select().where(HarvestClient.clientId == clientId)[0]
-    if len(client.projects) == 1:
-        print(f'Only 1 project, selecting "{client.projects[0].name}"')
-        projectId = client.projects[0].projectId
-    else:
-        projectId = fzf({x.projectId: x.name for x in client.projects}, "Project?")
-    project = HarvestProject.select().where(HarvestProject.projectId == projectId)[0]
-    if len(project.tasks) == 1:
-        print(f'Only 1 task, selecting "{project.tasks[0].name}"')
-        taskId = project.tasks[0].taskId
-    else:
-        taskId = fzf({x.taskId: x.name for x in project.tasks}, "Task?")
-    task = HarvestTask.select().where(HarvestTask.taskId == taskId)[0]
+    client, project, task = select_harvest_task()
 
-    presetName = input("Preset name (= Harvest comment)? ")
+    presetName = ask("Preset name (= Harvest comment)? ")
     preset_data = {
         "uuid": get_short_uuid(),
         "name": presetName,
@@ -509,8 +742,9 @@ def add_preset():
 def start_preset():
     presetId = fzf({x.uuid: x.name for x in Preset.select()}, "Preset?")
     preset = Preset.select().where(Preset.uuid == presetId)[0]
-    project = HarvestProject.select().where(HarvestProject.name == preset.project)[0]
-    task = HarvestTask.select().where(HarvestTask.name == preset.task)[0]
+    catalog = get_catalog()
+    project = catalog.projectsByName[preset.project]
+    task = catalog.tasksByName[(project.projectId, preset.task)]
     comment = preset.name
     start_task(
         taskId=task.taskId,
@@ -521,7 +755,7 @@ def start_preset():
 
 
 def change_target() -> None:
-    hours = float(input("New daily target in hours? "))
+    hours = float(ask("New daily target in hours? "))
     DailyTarget.delete().execute()
     DailyTarget.create(hours=hours)
 
@@ -531,95 +765,297 @@ def delete_target() -> None:
     print("Removed daily target")
 
 
-def main() -> bool | None:
-    parser = argparse.ArgumentParser(description="Time logging tool")
+# --since/--until/--project (+ --logged/--unlogged) for `task_utils.filter_tasks`
+def _add_filter_args(parser, logged: bool = False, helpPrefix: str = ""):
     parser.add_argument(
-        "-d",
-        "--debug",
-        help="Output debugging info",
-        action="store_const",
-        dest="debug",
-        const=True,
-        default=False,
+        "--since", type=date.fromisoformat, help=f"{helpPrefix}First day (YYYY-MM-DD)"
     )
     parser.add_argument(
-        "-q",
-        "--quiet",
-        help="Don't output to stdout",
-        action="store_const",
-        dest="quiet",
-        const=True,
-        default=False,
+        "--until", type=date.fromisoformat, help=f"{helpPrefix}Last day (YYYY-MM-DD)"
     )
+    parser.add_argument("--project", help=f"{helpPrefix}Harvest project ID or name")
+    if logged:
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument(
+            "--logged", dest="logged", action="store_const", const=True, default=None
+        )
+        group.add_argument(
+            "--unlogged", dest="logged", action="store_const", const=False
+        )
 
-    subparsers = parser.add_subparsers(dest="command")
 
-    subparsers.add_parser("start", help="Start a task")
-    rename_parser = subparsers.add_parser("rename", help="Rename last task")
-    rename_parser.add_argument("task_name", help="New name of the task")
-    show_parser = subparsers.add_parser("show", help="Show past tasks")
-    show_parser.add_argument(
+def _add_show_args(parser):
+    parser.add_argument(
         "filter",
         help="Which tasks to show",
         choices=["all", "today", "unlogged", "week"],
     )
-    show_parser.add_argument(
+    parser.add_argument(
         "--kw", type=int, help="Calendar week to print for `show week`.", default=None
     )
-    subparsers.add_parser("log", help="Mark all tasks as logged")
-    subparsers.add_parser(
-        "unlog", help="Undo the last operation that marked tasks logged."
-    )
-    status_parser = subparsers.add_parser(
-        "status", help="Show info about currently running task"
-    )
-    subparsers.add_parser("stop", help="Stop current task")
-    subparsers.add_parser("pull", help="Sync Harvest data back to local db")
-    assign_parser = subparsers.add_parser(
-        "assign", help="Assign last task to Harvest task"
-    )
-    assign_parser.add_argument(
-        "--uuid", type=str, help="UUID to re-assign", default=None
-    )
-    subparsers.add_parser("abort", help="Abort current task")
-    subparsers.add_parser("extend", help="Set the last completed task to running")
-    subparsers.add_parser("resume", help="Start a new instance of a past task")
-    subparsers.add_parser("push", help="Upload unlogged tasks to Harvest")
-    split_parser = subparsers.add_parser("split", help="Partially re-assign last task")
-    split_parser.add_argument("task_name", help="New name of the task")
-    subparsers.add_parser("setup", help="Initialize the database (first-time only)")
-    subparsers.add_parser("edit", help="Edit a task")
-    subparsers.add_parser("add", help="Add a task")
-    subparsers.add_parser("delete", help="Delete a task")
-    preset_parser = subparsers.add_parser("preset", help="Manage/use presets")
-    preset_parser.add_argument(
+    _add_filter_args(parser, helpPrefix="`show all`: ")
+    parser.add_argument("--limit", type=int, help="`show all`: show at most N tasks")
+    parser.add_argument(
+        "--offset", type=int, help="`show all`: skip the first N tasks", default=0
+    )
+    parser.add_argument(
+        "--no-pager",
+        dest="pager",
+        action="store_false",
+        help="`show all`: don't pipe the output through $PAGER",
+    )
+
+
+def _add_export_args(parser):
+    from export import EXPORT_FORMATS
+
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument(
+        "-o", "--output", help="File to write to, default: stdout", default=None
+    )
+    _add_filter_args(parser, logged=True)
+
+
+def _add_search_args(parser):
+    parser.add_argument(
+        "query",
+        nargs="+",
+        help='Words to search for as prefixes, "quoted words" as phrase, AND/OR/NOT',
+    )
+    _add_filter_args(parser)
+    parser.add_argument(
+        "--limit", type=int, default=50, help="Number of tasks, 0 for all"
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="Pick one of the results to resume"
+    )
+
+
+def _add_stats_args(parser):
+    _add_filter_args(parser)
+    parser.add_argument(
+        "--trend", choices=["month", "week"], default="month", help="Trend buckets"
+    )
+    parser.add_argument("--top", type=int, default=10, help="Projects to list")
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+
+
+def _add_report_args(parser):
+    _add_filter_args(parser, logged=True)
+    parser.add_argument(
+        "--by",
+        type=lambda value: value.split(","),
+        default=["client", "project"],
+        help="Comma-separated groups out of client,project,task",
+    )
+    parser.add_argument(
+        "--bucket", choices=["day", "week", "month"], help="Split the groups by time"
+    )
+    parser.add_argument("--format", choices=["table", "csv", "json"], default="table")
+
+
+def _add_task_name_arg(parser):
+    parser.add_argument("task_name", help="New name of the task")
+
+
+def _add_pull_args(parser):
+    parser.add_argument(
+        "--full",
+        help="Re-fetch all project assignments instead of only changed ones",
+        action="store_true",
+    )
+
+
+def _add_assign_args(parser):
+    parser.add_argument("--uuid", type=str, help="UUID to re-assign", default=None)
+
+
+def _add_preset_args(parser):
+    parser.add_argument(
         "preset_command",
         help="preset command",
         choices=["add", "delete", "start", "list"],
     )
-    target_parser = subparsers.add_parser("target", help="Change/remove daily target")
-    target_parser.add_argument(
+
+
+def _add_target_args(parser):
+    parser.add_argument(
         "target_command",
         help="target command",
         choices=["change", "delete"],
     )
-    archive_parser = subparsers.add_parser(
-        "archive", help="Archive week's tasks in human readable form"
+
+
+def _add_refresh_hours_args(parser):
+    parser.add_argument(
+        "weeks", nargs="*", help="ISO weeks like 2024-W05, default: this week"
     )
-    archive_parser.add_argument(
-        "--kw", type=int, help="Calendar week to print for `show week`.", default=None
+    parser.add_argument("--release-lock", action="store_true", help=argparse.SUPPRESS)
+
+
+def _add_archive_args(parser):
+    parser.add_argument(
+        "--kw", type=int, help="Calendar week to archive, default: this week"
+    )
+    parser.add_argument(
+        "--year", type=int, help="ISO year of `--kw`, default: this year"
+    )
+    parser.add_argument(
+        "--from",
+        dest="first",
+        type=harvest_hours.parse_week,
+        help="First ISO week of a range to archive, e.g. 2024-W05",
+    )
+    parser.add_argument(
+        "--to",
+        dest="last",
+        type=harvest_hours.parse_week,
+        help="Last ISO week of the range, default: this week",
+    )
+    parser.add_argument(
+        "--all", action="store_true", help="Archive every week that has tasks"
     )
 
-    args = parser.parse_args()
+
+# name: (help, function adding the subcommand's arguments)
+SUBCOMMANDS = {
+    "start": ("Start a task", None),
+    "rename": ("Rename last task", _add_task_name_arg),
+    "show": ("Show past tasks", _add_show_args),
+    "log": ("Mark all tasks as logged", None),
+    "unlog": ("Undo the last operation that marked tasks logged.", None),
+    "status": ("Show info about currently running task", None),
+    "stop": ("Stop current task", None),
+    "pull": ("Sync Harvest data back to local db", _add_pull_args),
+    "assign": ("Assign last task to Harvest task", _add_assign_args),
+    "abort": ("Abort current task", None),
+    "extend": ("Set the last completed task to running", None),
+    "resume": ("Start a new instance of a past task", None),
+    "search": ("Search past tasks by name, most recent first", _add_search_args),
+    "push": ("Upload unlogged tasks to Harvest", None),
+    "flush": ("Upload the tasks in the outbox that are due", None),
+    "outbox": ("Show tasks waiting for upload to Harvest", None),
+    "split": ("Partially re-assign last task", _add_task_name_arg),
+    "setup": ("Initialize the database (first-time only)", None),
+    "edit": ("Edit a task", None),
+    "add": ("Add a task", None),
+    "delete": ("Delete a task", None),
+    "preset": ("Manage/use presets", _add_preset_args),
+    "target": ("Change/remove daily target", _add_target_args),
+    "rebuild-rollups": ("Recompute + verify the duration rollup table", None),
+    "archive": ("Archive week's tasks in human readable form", _add_archive_args),
+    "export": ("Export finished tasks as CSV/NDJSON/JSON", _add_export_args),
+    "stats": ("Show hours per weekday/hour/project + trend", _add_stats_args),
+    "report": ("Sum hours per client/project/task", _add_report_args),
+    "refresh-hours": (
+        "Update the cached Harvest hours of the given weeks",
+        _add_refresh_hours_args,
+    ),
+    "daemon": ("Serve commands over a Unix socket, see `client.py`", None),
+}
+
+
+# Non-interactive commands that write: take the write lock right away, so they
+# wait for `busy_timeout` instead of failing on a read -> write lock upgrade.
+# Commands that prompt first keep a deferred transaction so that they don't
+# block other writers while waiting for user input.
+IMMEDIATE_WRITE_COMMANDS = {
+    "stop",
+    "abort",
+    "extend",
+    "rename",
+    "log",
+    "unlog",
+    "push",
+    "rebuild-rollups",
+}
+
+# With HARVEST_AUTO_FLUSH, finished tasks are uploaded from the outbox by a
+# detached `task flush` after any other command, unless a long-running process
+# (`task daemon`) does it
+FLUSH_IN_BACKGROUND = HARVEST_AUTO_FLUSH
+OUTBOX_COMMANDS = {"push", "flush"}
+
+
+def build_parser(argv: List[str]) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Time logging tool")
+    parser.add_argument(
+        "-d",
+        "--debug",
+        help="Output debugging info",
+        action="store_const",
+        dest="debug",
+        const=True,
+        default=False,
+    )
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        help="Don't output to stdout",
+        action="store_const",
+        dest="quiet",
+        const=True,
+        default=False,
+    )
+    parser.add_argument(
+        "--trace",
+        help="Print query count, SQL/HTTP time and wall time to stderr",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Write cProfile stats of the command to this file",
+        metavar="FILE",
+        default=None,
+    )
+
+    subparsers = parser.add_subparsers(dest="command")
+
+    # Only build the subparser that is needed, all of them for help/errors
+    command = get_command(argv)
+    if command in SUBCOMMANDS:
+        commands = [command]
+    else:
+        commands = list(SUBCOMMANDS)
+    for name in commands:
+        helpText, add_args = SUBCOMMANDS[name]
+        subparser = subparsers.add_parser(name, help=helpText)
+        if add_args:
+            add_args(subparser)
+    return parser
+
+
+def main(argv: List[str] | None = None) -> bool | None:
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = build_parser(argv)
+    args = parser.parse_args(argv)
 
     global QUIET
     QUIET = args.quiet
 
-    with db:
+    if args.command == "daemon":
+        from daemon import serve
+
+        serve()
+        return
+
+    with contextlib.ExitStack() as stack:
+        if args.profile:
+            stack.enter_context(tracing.profile(args.profile))
+        if args.trace:
+            stack.enter_context(tracing.trace(label=args.command or "summary"))
+        return run_command(args)
+
+
+def run_command(args) -> bool | None:
+    lock_type = "IMMEDIATE" if args.command in IMMEDIATE_WRITE_COMMANDS else None
+    with session(lock_type):
+        if args.command != "setup":
+            migrate()
         match args.command:
             case "start":
-                start_task(stopPrevious=True)
-                assign_task()
+                start_new_task()
                 update_statusbar()
             case "resume":
                 resume_task()
@@ -641,14 +1077,55 @@ def main() -> bool | None:
                 return ret if QUIET else True
             case "unlog":
                 unlog_tasks()
+                update_statusbar()
             case "log":
                 log_tasks()
+                update_statusbar()
             case "push":
-                push_unlogged_tasks()
+                queue_for_upload(get_unlogged_tasks())
+            case "outbox":
+                show_outbox()
+            case "search":
+                search_task_list(args)
+            case "export":
+                export_task_list(args)
+            case "stats":
+                from stats import show_stats
+
+                show_stats(
+                    args.since,
+                    args.until,
+                    args.project,
+                    args.trend,
+                    args.top,
+                    args.json,
+                )
+            case "report":
+                from report import REPORT_GROUPS, show_report
+
+                for group in args.by:
+                    assert group in REPORT_GROUPS, f"Unknown group '{group}'"
+                show_report(
+                    args.format,
+                    since=args.since,
+                    until=args.until,
+                    groups=args.by,
+                    bucket=args.bucket,
+                    logged=args.logged,
+                    project=args.project,
+                )
             case "archive":
-                archive_week(args.kw)
-            case "pull":
-                pull()
+                if args.all or args.first or args.last:
+                    archive_weeks(args.first, args.last)
+                else:
+                    archive_week(args.kw, args.year)
+            case "pull" | "flush":
+                # Wait for Harvest outside of this transaction, see below
+                pass
+            case "rebuild-rollups":
+                rebuild_rollups()
+            case "refresh-hours":
+                refresh_hours(args.weeks, args.release_lock)
             case "show":
                 match args.filter:
                     case "today":
@@ -656,21 +1133,31 @@ def main() -> bool | None:
                     case "unlogged":
                         show_unlogged_tasks()
                     case "all":
-                        show_all_tasks()
+                        show_all_tasks(
+                            args.since,
+                            args.until,
+                            args.project,
+                            args.limit,
+                            args.offset,
+                            args.pager,
+                        )
                     case "week":
                         print(get_week_overview(args.kw))
             case "assign":
                 assign_task(args.uuid)
             case "split":
                 split_task(args.task_name)
+                update_statusbar()
             case "setup":
                 setup()
             case "edit":
                 edit_task()
             case "add":
                 add_old_task()
+                update_statusbar()
             case "delete":
                 delete_task()
+                update_statusbar()
             case "target":
                 match args.target_command:
                     case "change":
@@ -687,24 +1174,41 @@ def main() -> bool | None:
                         start_preset()
                         update_statusbar()
                     case "list":
+                        import pretty_print
+
                         pretty_print.list_presets()
             case _:
                 print_day_summary()
 
+        if FLUSH_IN_BACKGROUND and args.command not in OUTBOX_COMMANDS:
+            outbox.flush_in_background()
         if args.debug:
             show_db()
 
+    # Network commands open their own, short transactions
+    match args.command:
+        case "push":
+            return push_unlogged_tasks()
+        case "flush":
+            outbox.flush()
+        case "pull" | "setup":
+            from harvest import pull
 
-if __name__ == "__main__":
+            pull(args.command == "pull" and args.full)
+
+
+def run(argv: List[str] | None = None) -> int:
     try:
-        ret = main()
-        if isinstance(ret, bool):
-            if ret:
-                sys.exit(0)
-            else:
-                sys.exit(1)
+        ret = main(argv)
+        if isinstance(ret, bool) and not ret:
+            return 1
+        return 0
     except Exception as e:
         print(str(e))
-        sys.exit(1)
+        return 1
     except KeyboardInterrupt:
-        sys.exit(1)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(run())
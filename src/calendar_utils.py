@@ -1,4 +1,9 @@
-from datetime import datetime, date, timedelta
+from datetime import datetime, date, time, timedelta
+from typing import Tuple
+
+# Half-open [start, end) interval, compare with `>= start` and `< end` so that
+# range filters can use the index on `Task.start_time`.
+DateRange = Tuple[datetime, datetime]
 
 
 def get_week_string(KW: str | None = None) -> str:
@@ -21,3 +26,18 @@ def get_iso_week_dates(iso_year, iso_week):
     start_date = datetime.strptime(f"{iso_year}-W{iso_week}-1", "%G-W%V-%u").date()
     end_date = start_date + timedelta(days=6)  # End of the week
     return start_date, end_date
+
+
+def day_range(day: date) -> DateRange:
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+
+def today_range() -> DateRange:
+    return day_range(date.today())
+
+
+def iso_week_range(iso_year, iso_week) -> DateRange:
+    start = datetime.fromisocalendar(int(iso_year), int(iso_week), 1)
+    return start, start + timedelta(days=7)
+
@@ -0,0 +1,264 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+from peewee import chunked
+
+from db_config import db
+from env import TIMETRACK_DB
+from model import HarvestClient, HarvestProject, HarvestTask, SyncState
+
+ASSIGNMENTS_SYNCED_AT = "assignments_synced_at"
+# Bumped by every sync, the snapshot file and the in-process copy of the
+# catalog are only used while their generation matches
+CATALOG_GENERATION = "catalog_generation"
+CATALOG_FILE = Path(f"{TIMETRACK_DB}.catalog.json")
+
+
+def get_sync_state(key: str) -> str | None:
+    state = SyncState.get_or_none(SyncState.key == key)
+    return state.value if state else None
+
+
+def set_sync_state(key: str, value: str):
+    SyncState.replace(key=key, value=value).execute()
+
+
+def _delete_ids(model, ids):
+    for batch in chunked(list(ids), 500):
+        model.delete().where(model.id.in_(batch)).execute()
+
+
+def _parse_assignments(assignments: List[Dict]):
+    clients: Dict[int, str] = {}
+    projects: Dict[int, Tuple[str, int]] = {}
+    tasks: Dict[int, Dict[int, str]] = {}
+    inactiveProjects: Set[int] = set()
+    for assignment in assignments:
+        projectId = int(assignment["project"]["id"])
+        if not assignment.get("is_active", True):
+            inactiveProjects.add(projectId)
+            continue
+        clientId = int(assignment["client"]["id"])
+        clients[clientId] = str(assignment["client"]["name"])
+        projects[projectId] = (str(assignment["project"]["name"]), clientId)
+        tasks[projectId] = {
+            int(taskAssignment["task"]["id"]): str(taskAssignment["task"]["name"])
+            for taskAssignment in assignment["task_assignments"]
+            if taskAssignment.get("is_active", True)
+        }
+    return clients, projects, tasks, inactiveProjects
+
+
+# With `full`, `assignments` is the complete list and anything missing from it
+# is removed. Otherwise it only holds the assignments changed since the last
+# sync, so only projects that were deactivated in the meantime are removed.
+def sync_catalog(assignments: List[Dict], full: bool, synced_at: str):
+    remoteClients, remoteProjects, remoteTasks, inactiveProjects = _parse_assignments(
+        assignments
+    )
+    with db.atomic():
+        localClients = {c.clientId: c for c in HarvestClient.select()}
+        newClients = [
+            {"clientId": clientId, "name": name}
+            for clientId, name in remoteClients.items()
+            if clientId not in localClients
+        ]
+        for batch in chunked(newClients, 100):
+            HarvestClient.insert_many(batch).execute()
+        for clientId, name in remoteClients.items():
+            client = localClients.get(clientId)
+            if client and client.name != name:
+                HarvestClient.update(name=name).where(
+                    HarvestClient.id == client.id
+                ).execute()
+        clientIds = {
+            clientId: rowId
+            for clientId, rowId in HarvestClient.select(
+                HarvestClient.clientId, HarvestClient.id
+            ).tuples()
+        }
+
+        localProjects = {p.projectId: p for p in HarvestProject.select()}
+        removedProjects = inactiveProjects & localProjects.keys()
+        if full:
+            removedProjects |= localProjects.keys() - remoteProjects.keys()
+        removedProjectIds = [localProjects[p].id for p in removedProjects]
+        for batch in chunked(removedProjectIds, 500):
+            HarvestTask.delete().where(HarvestTask.project.in_(batch)).execute()
+        _delete_ids(HarvestProject, removedProjectIds)
+        newProjects = [
+            {"projectId": projectId, "name": name, "client": clientIds[clientId]}
+            for projectId, (name, clientId) in remoteProjects.items()
+            if projectId not in localProjects
+        ]
+        for batch in chunked(newProjects, 100):
+            HarvestProject.insert_many(batch).execute()
+        for projectId, (name, clientId) in remoteProjects.items():
+            project = localProjects.get(projectId)
+            if project and (
+                project.name != name or project.client_id != clientIds[clientId]
+            ):
+                HarvestProject.update(name=name, client=clientIds[clientId]).where(
+                    HarvestProject.id == project.id
+                ).execute()
+        projectIds = {
+            projectId: (rowId, clientId)
+            for projectId, rowId, clientId in HarvestProject.select(
+                HarvestProject.projectId, HarvestProject.id, HarvestProject.client
+            ).tuples()
+        }
+
+        localTasks = {}
+        for task in HarvestTask.select(HarvestTask, HarvestProject.projectId).join(
+            HarvestProject
+        ):
+            localTasks[(task.project.projectId, task.taskId)] = task
+        newTasks = []
+        removedTaskIds = []
+        for projectId, tasks in remoteTasks.items():
+            rowId, clientId = projectIds[projectId]
+            for taskId, name in tasks.items():
+                task = localTasks.get((projectId, taskId))
+                if not task:
+                    newTasks.append(
+                        {
+                            "taskId": taskId,
+                            "project": rowId,
+                            "client": clientId,
+                            "name": name,
+                        }
+                    )
+                elif task.name != name or task.client_id != clientId:
+                    HarvestTask.update(name=name, client=clientId).where(
+                        HarvestTask.id == task.id
+                    ).execute()
+        for (projectId, taskId), task in localTasks.items():
+            if projectId in remoteTasks and taskId not in remoteTasks[projectId]:
+                removedTaskIds.append(task.id)
+        _delete_ids(HarvestTask, removedTaskIds)
+        for batch in chunked(newTasks, 100):
+            HarvestTask.insert_many(batch).execute()
+
+        HarvestClient.delete().where(
+            HarvestClient.id.not_in(HarvestProject.select(HarvestProject.client))
+        ).execute()
+        set_sync_state(ASSIGNMENTS_SYNCED_AT, synced_at)
+        set_sync_state(CATALOG_GENERATION, str(get_generation() + 1))
+
+
+def get_generation() -> int:
+    return int(get_sync_state(CATALOG_GENERATION) or 0)
+
+
+# Plain objects with the attributes of the Harvest models, linked both ways
+class CatalogClient:
+    def __init__(self, clientId: int, name: str):
+        self.clientId = clientId
+        self.name = name
+        self.projects: List[CatalogProject] = []
+
+
+class CatalogProject:
+    def __init__(self, projectId: int, name: str, client: CatalogClient):
+        self.projectId = projectId
+        self.name = name
+        self.client = client
+        self.tasks: List[CatalogTask] = []
+
+
+class CatalogTask:
+    def __init__(self, taskId: int, name: str, project: CatalogProject):
+        self.taskId = taskId
+        self.name = name
+        self.project = project
+        self.client = project.client
+
+
+class Catalog:
+    def __init__(self, generation: int, data: Dict):
+        self.generation = generation
+        self.clients: Dict[int, CatalogClient] = {}
+        self.projects: Dict[int, CatalogProject] = {}
+        self.tasks: Dict[Tuple[int, int], CatalogTask] = {}
+        self.projectsByName: Dict[str, CatalogProject] = {}
+        self.tasksByName: Dict[Tuple[int, str], CatalogTask] = {}
+        for clientId, name in data["clients"]:
+            self.clients[clientId] = CatalogClient(clientId, name)
+        for projectId, name, clientId in data["projects"]:
+            project = CatalogProject(projectId, name, self.clients[clientId])
+            project.client.projects.append(project)
+            self.projects[projectId] = project
+            # First one wins, like `.select().where(name == ...)[0]`
+            self.projectsByName.setdefault(name, project)
+        for projectId, taskId, name in data["tasks"]:
+            project = self.projects[projectId]
+            task = CatalogTask(taskId, name, project)
+            project.tasks.append(task)
+            self.tasks[(projectId, taskId)] = task
+            self.tasksByName.setdefault((projectId, name), task)
+        # "client / project / task" order for pickers
+        self.sortedTasks = sorted(
+            self.tasks.values(),
+            key=lambda t: (t.client.name, t.project.name, t.name),
+        )
+
+
+def _read_catalog() -> Dict:
+    # Ordered by row ID, the order of the old `.select()` lookups
+    return {
+        "clients": list(
+            HarvestClient.select(HarvestClient.clientId, HarvestClient.name)
+            .order_by(HarvestClient.id)
+            .tuples()
+        ),
+        "projects": list(
+            HarvestProject.select(
+                HarvestProject.projectId, HarvestProject.name, HarvestClient.clientId
+            )
+            .join(HarvestClient)
+            .order_by(HarvestProject.id)
+            .tuples()
+        ),
+        "tasks": list(
+            HarvestTask.select(
+                HarvestProject.projectId, HarvestTask.taskId, HarvestTask.name
+            )
+            .join(HarvestProject)
+            .order_by(HarvestTask.id)
+            .tuples()
+        ),
+    }
+
+
+# Called at the end of `pull`, and when the file is missing or outdated
+def write_catalog_file(generation: int | None = None) -> Dict:
+    if generation is None:
+        generation = get_generation()
+    data = {"generation": generation, **_read_catalog()}
+    tmpPath = CATALOG_FILE.with_name(f".{CATALOG_FILE.name}.{os.getpid()}.tmp")
+    with open(tmpPath, "w") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmpPath, CATALOG_FILE)
+    return data
+
+
+_catalog: Catalog | None = None
+
+
+# One query for the generation, the file is only read again after a pull
+def get_catalog() -> Catalog:
+    global _catalog
+    generation = get_generation()
+    if _catalog and _catalog.generation == generation:
+        return _catalog
+    try:
+        with open(CATALOG_FILE) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = None
+    if not data or data.get("generation") != generation:
+        data = write_catalog_file(generation)
+    _catalog = Catalog(generation, data)
+    return _catalog
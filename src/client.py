@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# Thin entry point for `task`: forwards hot commands to a running `task daemon`
+# and falls back to running them in-process. Keep the imports to the stdlib
+# modules below, this runs on every keybinding/status bar poll.
+
+import json
+import os
+import socket
+import sys
+from typing import List
+
+SOCKET_PATH = os.getenv("TIMETRACK_SOCKET", "/tmp/timetrack.sock")
+# Commands that never prompt or render with `rich`
+DAEMON_COMMANDS = {
+    "status",
+    "stop",
+    "abort",
+    "extend",
+    "rename",
+    "show",
+    "log",
+    "unlog",
+    "outbox",
+}
+
+
+# Global options of `app.build_parser` that take a value
+OPTIONS_WITH_VALUE = {"--profile"}
+
+
+def get_command(argv: List[str]) -> str | None:
+    previous = None
+    for arg in argv:
+        if not arg.startswith("-") and previous not in OPTIONS_WITH_VALUE:
+            return arg
+        previous = arg
+    return None
+
+
+# A daemon that doesn't answer within this time is treated as not running
+DAEMON_TIMEOUT_SECONDS = 10
+
+
+def forward(argv: List[str]) -> int | None:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(DAEMON_TIMEOUT_SECONDS)
+            sock.connect(SOCKET_PATH)
+            sock.sendall(json.dumps({"argv": argv}).encode("utf-8") + b"\n")
+            sock.shutdown(socket.SHUT_WR)
+            data = b""
+            while chunk := sock.recv(65536):
+                data += chunk
+        response = json.loads(data.decode("utf-8"))
+    except (OSError, ValueError):
+        # Not running, or it died or hung during the request
+        return None
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    return response["code"]
+
+
+def main() -> int:
+    argv = sys.argv[1:]
+    if get_command(argv) in DAEMON_COMMANDS and "-d" not in argv:
+        code = forward(argv)
+        if code is not None:
+            return code
+    import app
+
+    return app.run(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
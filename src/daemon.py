@@ -0,0 +1,139 @@
+import contextlib
+import io
+import json
+import os
+import socket
+import sys
+import threading
+
+import app
+import outbox
+from client import DAEMON_COMMANDS, get_command
+from db_config import db, session
+from env import HARVEST_AUTO_FLUSH, TIMETRACK_SOCKET
+from migrations import migrate
+from task_utils import get_running_task
+
+
+class RunningTaskCache:
+    def __init__(self):
+        self.data_version = None
+        self.task = None
+
+    def invalidate(self):
+        self.data_version = None
+
+    def get(self):
+        # data_version changes whenever another connection commits
+        version = db.execute_sql("PRAGMA data_version").fetchone()[0]
+        if version != self.data_version:
+            with session():
+                self.task = get_running_task()
+            self.data_version = version
+        return self.task
+
+
+# Seconds between outbox flushes, commands wake the flusher right away
+OUTBOX_FLUSH_INTERVAL = 60
+
+
+def flush_outbox(wakeup: threading.Event):
+    # Own thread + connection, so that requests don't wait for Harvest
+    while True:
+        wakeup.wait(OUTBOX_FLUSH_INTERVAL)
+        wakeup.clear()
+        try:
+            with session():
+                due = outbox.has_due_entries()
+            if due:
+                outbox.flush()
+        except Exception as e:
+            print(f"Flushing the outbox failed: {e}", file=sys.__stderr__)
+
+
+def handle(argv, cache: RunningTaskCache) -> dict:
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        if get_command(argv) not in DAEMON_COMMANDS:
+            print(f"Command not supported by the daemon: {' '.join(argv)}")
+            code = 1
+        elif argv == ["status"]:
+            app.QUIET = False
+            try:
+                app.print_status(cache.get())
+                code = 0
+            except Exception as e:
+                print(str(e))
+                code = 1
+        else:
+            try:
+                code = app.run(argv)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            cache.invalidate()
+    return {"stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "code": code}
+
+
+# Seconds a client gets to send its request + to receive the response
+REQUEST_TIMEOUT_SECONDS = 2
+
+
+def serve_request(conn: socket.socket, cache: RunningTaskCache, wakeup):
+    data = b""
+    while chunk := conn.recv(65536):
+        data += chunk
+    if not data:
+        # Probe of `remove_stale_socket`
+        return
+    request = json.loads(data.decode("utf-8"))
+    response = handle(request["argv"], cache)
+    if request["argv"] != ["status"]:
+        wakeup.set()
+    conn.sendall(json.dumps(response).encode("utf-8"))
+
+
+def remove_stale_socket():
+    if not os.path.exists(TIMETRACK_SOCKET):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(TIMETRACK_SOCKET)
+        except ConnectionRefusedError:
+            # Left behind by a daemon that didn't shut down cleanly
+            os.remove(TIMETRACK_SOCKET)
+            return
+    raise RuntimeError(f"A daemon is already listening on {TIMETRACK_SOCKET}")
+
+
+def serve():
+    remove_stale_socket()
+    db.connect(reuse_if_open=True)
+    with session():
+        migrate()
+    cache = RunningTaskCache()
+    app.FLUSH_IN_BACKGROUND = False
+    wakeup = threading.Event()
+    if HARVEST_AUTO_FLUSH:
+        threading.Thread(target=flush_outbox, args=(wakeup,), daemon=True).start()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(TIMETRACK_SOCKET)
+        os.chmod(TIMETRACK_SOCKET, 0o600)
+        server.listen()
+        print(f"Listening on {TIMETRACK_SOCKET}")
+        try:
+            while True:
+                conn, _ = server.accept()
+                with conn:
+                    # A client that doesn't send its request in time would
+                    # block all others
+                    conn.settimeout(REQUEST_TIMEOUT_SECONDS)
+                    try:
+                        serve_request(conn, cache, wakeup)
+                    except (OSError, ValueError) as e:
+                        print(f"Dropped a request: {e}", file=sys.__stderr__)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(TIMETRACK_SOCKET)
+            db.close()
@@ -1,5 +1,83 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+
 from peewee import SqliteDatabase
 from pathlib import Path
-from env import TIMETRACK_DB
+import tracing
+from env import (
+    DB_BUSY_TIMEOUT_MS,
+    DB_CACHE_SIZE,
+    DB_JOURNAL_MODE,
+    DB_MMAP_SIZE,
+    DB_OPTIMIZE_ON_CLOSE,
+    DB_SYNCHRONOUS,
+    TIMETRACK_DB,
+)
+
+
+class TimetrackDatabase(SqliteDatabase):
+    def execute_sql(self, sql, params=None):
+        start = time.perf_counter()
+        try:
+            return super().execute_sql(sql, params)
+        finally:
+            tracing.record_query(time.perf_counter() - start)
+
+    def _close(self, conn):
+        if DB_OPTIMIZE_ON_CLOSE:
+            try:
+                conn.execute("PRAGMA optimize")
+            except sqlite3.Error:
+                pass
+        super()._close(conn)
+
+
+db = TimetrackDatabase(
+    TIMETRACK_DB,
+    timeout=DB_BUSY_TIMEOUT_MS / 1000,
+    pragmas={
+        "journal_mode": DB_JOURNAL_MODE,
+        "busy_timeout": DB_BUSY_TIMEOUT_MS,
+        "synchronous": DB_SYNCHRONOUS,
+        "cache_size": DB_CACHE_SIZE,
+        "mmap_size": DB_MMAP_SIZE,
+    },
+)
+
+
+@contextmanager
+def session(lock_type: str | None = None):
+    # A long-running process (`task daemon`) keeps its connection open, only
+    # wrap the command in a transaction then
+    if db.is_closed():
+        db.connect()
+        try:
+            with db.atomic(lock_type):
+                yield
+        finally:
+            db.close()
+    else:
+        with db.atomic(lock_type):
+            yield
+
 
-db = SqliteDatabase(TIMETRACK_DB)
+# Waiting for user input or for Harvest in a read transaction keeps an old WAL
+# snapshot, the first write then fails with SQLITE_BUSY_SNAPSHOT if another
+# process (e.g. a background `task flush`) committed in the meantime. Commits
+# what the command did so far and continues in a new transaction that holds the
+# write lock.
+@contextmanager
+def waiting():
+    # Savepoints (nested `db.atomic()`) can't be committed on their own
+    if db.is_closed() or db.transaction_depth() != 1:
+        yield
+        return
+    db.commit()
+    try:
+        yield
+    except BaseException:
+        # Rolled back by the session
+        db.begin()
+        raise
+    db.begin("IMMEDIATE")
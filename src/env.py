@@ -7,13 +7,33 @@ dotenv_path = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(dotenv_path=dotenv_path)
 
 TIMETRACK_DB = os.getenv("TIMETRACK_DB", "/tmp/timetrack.db")
+DB_JOURNAL_MODE = os.getenv("TIMETRACK_DB_JOURNAL_MODE", "wal")
+DB_BUSY_TIMEOUT_MS = int(os.getenv("TIMETRACK_DB_BUSY_TIMEOUT_MS", 5000))
+DB_SYNCHRONOUS = os.getenv("TIMETRACK_DB_SYNCHRONOUS", "normal")
+DB_CACHE_SIZE = int(os.getenv("TIMETRACK_DB_CACHE_SIZE", -8000))
+DB_MMAP_SIZE = int(os.getenv("TIMETRACK_DB_MMAP_SIZE", 64 * 1024 * 1024))
+DB_OPTIMIZE_ON_CLOSE = os.getenv("TIMETRACK_DB_OPTIMIZE_ON_CLOSE", "1") == "1"
 TASK_ID = os.getenv("TASK_ID", "1")
 PROJECT_ID = os.getenv("TASK_ID", "1")
 ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", "/tmp/archive"))
 STATUSBAR_FILE = Path(os.getenv("STATUSBAR_FILE", "/tmp/task"))
+STATUSBAR_FORMATS = os.getenv("STATUSBAR_FORMATS", "json").split(",")
+TIMETRACK_SOCKET = os.getenv("TIMETRACK_SOCKET", "/tmp/timetrack.sock")
 
 EMAIL = os.getenv("EMAIL")
 HARVEST_TOKEN = os.getenv("HARVEST_TOKEN")
 HARVEST_ACCOUNT_ID = os.getenv("HARVEST_ACCOUNT_ID")
+HARVEST_BASE_URL = os.getenv(
+    "HARVEST_BASE_URL", "https://api.harvestapp.com/v2"
+).rstrip("/")
 HOURS = os.getenv("HOURS", "10")
-WEEKLY_HOUR_API_INDEX = int(os.getenv("WEEKLY_HOUR_API_INDEX", 0))
+HARVEST_HOURS_TTL = int(os.getenv("HARVEST_HOURS_TTL", 900))
+# Upload stopped tasks without `task push`, after they were left alone for
+# HARVEST_FLUSH_DELAY seconds
+HARVEST_AUTO_FLUSH = os.getenv("HARVEST_AUTO_FLUSH", "0") == "1"
+HARVEST_FLUSH_DELAY = int(os.getenv("HARVEST_FLUSH_DELAY", 600))
+# "flat": one picker for client / project / task, "steps": one picker each
+ASSIGN_PICKER = os.getenv("ASSIGN_PICKER", "flat")
+HARVEST_PUSH_WORKERS = int(os.getenv("HARVEST_PUSH_WORKERS", 4))
+# Harvest allows 100 requests per 15 seconds
+HARVEST_RATE_LIMIT = int(os.getenv("HARVEST_RATE_LIMIT", 100))
@@ -0,0 +1,122 @@
+import csv
+import json
+from datetime import date
+from typing import Dict, Iterator, TextIO
+
+from model import HarvestClient, HarvestProject, HarvestTask, Task
+from task_utils import filter_tasks, join_catalog
+
+# Rows are streamed from the cursor one at a time, so exporting years of
+# history doesn't keep more than one task in memory.
+
+EXPORT_FORMATS = ["csv", "ndjson", "json"]
+EXPORT_FIELDS = [
+    "uuid",
+    "date",
+    "start_time",
+    "end_time",
+    "minutes",
+    "hours",
+    "name",
+    "is_logged",
+    "client_id",
+    "client",
+    "project_id",
+    "project",
+    "task_id",
+    "task",
+]
+
+
+def get_export_query(
+    since: date | None = None,
+    until: date | None = None,
+    logged: bool | None = None,
+    project: str | None = None,
+):
+    query = (
+        join_catalog(
+            Task.select(
+                Task.uuid,
+                Task.start_time,
+                Task.end_time,
+                Task.name,
+                Task.is_logged,
+                HarvestClient.clientId.alias("client_id"),
+                HarvestClient.name.alias("client"),
+                Task.projectId.alias("project_id"),
+                HarvestProject.name.alias("project"),
+                Task.taskId.alias("task_id"),
+                HarvestTask.name.alias("task"),
+            )
+        )
+        .where(Task.end_time.is_null(False))
+        .order_by(Task.start_time)
+    )
+    if logged is not None:
+        query = query.where(Task.is_logged == logged)
+    return filter_tasks(query, since, until, project)
+
+
+def get_rows(query) -> Iterator[Dict]:
+    for row in query.dicts().iterator():
+        start, end = row["start_time"], row["end_time"]
+        minutes = int((end - start).total_seconds() / 60)
+        yield {
+            "uuid": row["uuid"],
+            "date": start.date().isoformat(),
+            "start_time": start.isoformat(timespec="seconds"),
+            "end_time": end.isoformat(timespec="seconds"),
+            "minutes": minutes,
+            "hours": round(minutes / 60, 2),
+            "name": row["name"],
+            "is_logged": bool(row["is_logged"]),
+            "client_id": row["client_id"],
+            "client": row["client"],
+            "project_id": row["project_id"],
+            "project": row["project"],
+            "task_id": row["task_id"],
+            "task": row["task"],
+        }
+
+
+def write_csv(rows: Iterator[Dict], out: TextIO):
+    writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+
+
+def write_ndjson(rows: Iterator[Dict], out: TextIO):
+    for row in rows:
+        out.write(json.dumps(row, ensure_ascii=False))
+        out.write("\n")
+
+
+def write_json(rows: Iterator[Dict], out: TextIO):
+    # One array, written element by element
+    out.write("[")
+    for i, row in enumerate(rows):
+        out.write(",\n" if i else "\n")
+        out.write(json.dumps(row, ensure_ascii=False))
+    out.write("\n]\n")
+
+
+def export_tasks(out: TextIO, format: str = "csv", **filters) -> int:
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    rows = counted(get_rows(get_export_query(**filters)))
+    match format:
+        case "csv":
+            write_csv(rows, out)
+        case "ndjson":
+            write_ndjson(rows, out)
+        case "json":
+            write_json(rows, out)
+    return count
@@ -1,17 +1,35 @@
+import asyncio
 import json
+import threading
+import time
+import urllib.error
 import urllib.parse
 import urllib.request
-from datetime import datetime, timedelta
-from typing import TypedDict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Set, TypedDict
 
 from env import (
     EMAIL,
     HARVEST_ACCOUNT_ID,
+    HARVEST_BASE_URL,
+    HARVEST_PUSH_WORKERS,
+    HARVEST_RATE_LIMIT,
     HARVEST_TOKEN,
     PROJECT_ID,
     TASK_ID,
 )
-from model import HarvestClient, HarvestMeta, HarvestProject, HarvestTask, User
+import tracing
+from db_config import session, waiting
+from catalog import (
+    ASSIGNMENTS_SYNCED_AT,
+    get_sync_state,
+    sync_catalog,
+    write_catalog_file,
+)
+from harvest_hours import Week, store_hours
+from model import User
 from utils import get_task_length_in_mins
 
 
@@ -30,6 +48,71 @@ HARVEST_HEADERS = {
     "Authorization": "Bearer " + str(HARVEST_TOKEN),
     "Harvest-Account-Id": str(HARVEST_ACCOUNT_ID),
 }
+RATE_LIMIT_WINDOW_SECONDS = 15
+MAX_RATE_LIMIT_RETRIES = 3
+DEFAULT_PER_PAGE = 100
+# Marks time entries created by `task`, their external reference ID is the UUID
+EXTERNAL_REFERENCE_GROUP = "timetrack"
+TIME_ENTRIES_PER_PAGE = 2000
+
+
+class RateLimiter:
+    def __init__(self, max_requests: int, window: float):
+        self.max_requests = max_requests
+        self.window = window
+        self.timestamps = deque()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.timestamps and now - self.timestamps[0] >= self.window:
+                    self.timestamps.popleft()
+                if len(self.timestamps) < self.max_requests:
+                    self.timestamps.append(now)
+                    return
+                delay = self.window - (now - self.timestamps[0])
+            time.sleep(delay)
+
+
+rate_limiter = RateLimiter(HARVEST_RATE_LIMIT, RATE_LIMIT_WINDOW_SECONDS)
+
+
+def urlopen(request: urllib.request.Request):
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        rate_limiter.wait()
+        start = time.perf_counter()
+        try:
+            return urllib.request.urlopen(request, timeout=5)
+        except urllib.error.HTTPError as e:
+            if e.code != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                raise
+            retryAfter = float(e.headers.get("Retry-After", RATE_LIMIT_WINDOW_SECONDS))
+        finally:
+            tracing.record_http(time.perf_counter() - start)
+        time.sleep(retryAfter)
+
+
+def get_json(path: str, params: Dict | None = None) -> Dict:
+    url = f"{HARVEST_BASE_URL}/{path}"
+    if params:
+        url += "?" + urllib.parse.urlencode(params)
+    request = urllib.request.Request(url=url, headers=HARVEST_HEADERS)
+    with urlopen(request) as response:
+        responseCode = response.getcode()
+        if responseCode != 200:
+            raise Exception("Request to Harvest failed.")
+
+        responseBody = response.read().decode("utf-8")
+        return json.loads(responseBody)
+
+
+def fetch_user_id() -> str:
+    print("User ID not cached, getting it from Harvest API..")
+    userID = get_json("users/me")["id"]
+    print(f"User ID is {userID}.")
+    return userID
 
 
 def get_user_id() -> str:
@@ -37,109 +120,116 @@ def get_user_id() -> str:
     if user:
         return user[0].id
     else:
-        print("User ID not cached, getting it from Harvest API..")
-        url = "https://api.harvestapp.com/v2/users/me"
-        request = urllib.request.Request(url=url, headers=HARVEST_HEADERS)
-        with urllib.request.urlopen(request, timeout=5) as response:
-            responseCode = response.getcode()
-            if responseCode != 200:
-                raise Exception("Request to Harvest failed.")
+        userID = fetch_user_id()
+        User.create(id=userID)
+        return userID
 
-            responseBody = response.read().decode("utf-8")
-            jsonResponse = json.loads(responseBody)
-            userID = jsonResponse["id"]
-            print(f"User ID is {userID}.")
-            User.create(id=userID)
-            return userID
 
+def get_pages(path: str, params: Dict, key: str) -> List[Dict]:
+    params = dict(params, per_page=params.get("per_page", DEFAULT_PER_PAGE))
+    items = []
+    page = 1
+    while page:
+        params["page"] = page
+        jsonResponse = get_json(path, params)
+        items += jsonResponse[key]
+        page = jsonResponse.get("next_page")
+    return items
 
-def pull_weekly_harvest_hours(KW=None):
-    user_id = get_user_id()
+
+async def get_pages_concurrently(path: str, params: Dict, key: str) -> List[Dict]:
+    # The first page tells how many there are, the rest is fetched in parallel
+    params = dict(params, per_page=params.get("per_page", DEFAULT_PER_PAGE))
+    first = await asyncio.to_thread(get_json, path, dict(params, page=1))
+    rest = await asyncio.gather(
+        *(
+            asyncio.to_thread(get_json, path, dict(params, page=page))
+            for page in range(2, (first.get("total_pages") or 1) + 1)
+        )
+    )
+    items = list(first[key])
+    for jsonResponse in rest:
+        items += jsonResponse[key]
+    return items
+
+
+def fetch_harvest_hours(weeks: List[Week], user_id: str) -> Dict[Week, float]:
     assert all(var is not None for var in (EMAIL, HARVEST_ACCOUNT_ID, HARVEST_TOKEN)), (
         "Environment variable for Harvest upload is missing."
     )
-    if KW:
-        today = datetime.fromisocalendar(datetime.now().year, KW, 2)
-    else:
-        today = datetime.now()
-    monday = today - timedelta(days=today.weekday())
-    friday = today + timedelta(days=(4 - today.weekday()))
-    fromDate = monday.strftime("%Y%m%d")
-    toDate = friday.strftime("%Y%m%d")
-    url = f"https://api.harvestapp.com/v2/reports/time/team?from={fromDate}&to={toDate}"
-    request = urllib.request.Request(url=url, headers=HARVEST_HEADERS)
-    with urllib.request.urlopen(request, timeout=5) as response:
-        responseCode = response.getcode()
-        if responseCode != 200:
-            raise Exception("Request to Harvest failed.")
+    # One request (per page of entries) for the whole range of weeks
+    monday = min(date.fromisocalendar(year, week, 1) for year, week in weeks)
+    sunday = max(date.fromisocalendar(year, week, 7) for year, week in weeks)
+    hours = {}
+    day = monday
+    while day <= sunday:
+        hours[day.isocalendar()[:2]] = 0.0
+        day += timedelta(days=7)
+    params = {
+        "user_id": user_id,
+        "from": monday.strftime("%Y%m%d"),
+        "to": sunday.strftime("%Y%m%d"),
+        "per_page": TIME_ENTRIES_PER_PAGE,
+    }
+    for entry in get_pages("time_entries", params, "time_entries"):
+        year, week, _ = date.fromisoformat(entry["spent_date"]).isocalendar()
+        hours[(year, week)] += float(entry["hours"])
+    return hours
 
-        responseBody = response.read().decode("utf-8")
-        jsonResponse = json.loads(responseBody)
 
-    if not jsonResponse["results"] or user_id not in [
-        str(x["user_id"]) for x in jsonResponse["results"]
-    ]:
-        hours = 0.0
-    else:
-        hours = next(
-            x for x in jsonResponse["results"] if user_id in str(x["user_id"])
-        )["total_hours"]
-    HarvestMeta.delete().execute()
-    HarvestMeta.create(hours=hours)
+def pull_harvest_hours(weeks: List[Week]) -> Dict[Week, float]:
+    user_id = get_user_id()
+    with waiting():
+        hours = fetch_harvest_hours(weeks, user_id)
+    store_hours(hours)
+    return hours
 
 
-def pull_projects_clients_tasks():
+async def get_project_assignments(updated_since: str | None = None) -> List[Dict]:
     assert all(var is not None for var in (EMAIL, HARVEST_ACCOUNT_ID, HARVEST_TOKEN)), (
         "Environment variable for Harvest upload is missing."
     )
-    url = "https://api.harvestapp.com/v2/users/me/project_assignments"
-    request = urllib.request.Request(url=url, headers=HARVEST_HEADERS)
-    for table in [HarvestProject, HarvestTask, HarvestClient]:
-        table.drop_table()
-        table.create_table()
-    with urllib.request.urlopen(request, timeout=5) as response:
-        responseCode = response.getcode()
-        if responseCode != 200:
-            raise Exception("Request to Harvest failed.")
-
-        responseBody = response.read().decode("utf-8")
-        jsonResponse = json.loads(responseBody)
+    params = {}
+    if updated_since:
+        params["updated_since"] = updated_since
+    return await get_pages_concurrently(
+        "users/me/project_assignments", params, "project_assignments"
+    )
 
-    for projectAssignment in jsonResponse["project_assignments"]:
-        clientId = str(projectAssignment["client"]["id"])
-        clientName = str(projectAssignment["client"]["name"])
-        client, _ = HarvestClient.get_or_create(clientId=clientId, name=clientName)
 
-        projectId = str(projectAssignment["project"]["id"])
-        projectName = str(projectAssignment["project"]["name"])
-        project, _ = HarvestProject.get_or_create(
-            projectId=projectId, client=client, name=projectName
-        )
-        for taskAssignment in projectAssignment["task_assignments"]:
-            taskId = str(taskAssignment["task"]["id"])
-            taskName = str(taskAssignment["task"]["name"])
-            HarvestTask.get_or_create(
-                taskId=taskId,
-                project=project,
-                client=client,
-                name=taskName,
-            )
+def get_uploaded_uuids(tasks: List, user_id: str) -> Set[str]:
+    days = [task.start_time.date() for task in tasks]
+    params = {
+        "user_id": user_id,
+        "from": min(days).strftime("%Y%m%d"),
+        "to": max(days).strftime("%Y%m%d"),
+        "per_page": TIME_ENTRIES_PER_PAGE,
+    }
+    uuids = set()
+    for entry in get_pages("time_entries", params, "time_entries"):
+        reference = entry.get("external_reference") or {}
+        if reference.get("group_id") == EXTERNAL_REFERENCE_GROUP:
+            uuids.add(reference["id"])
+    return uuids
 
 
-def push_harvest_task(data: RemoteHarvestTask):
-    data_encoded = urllib.parse.urlencode(data).encode("ascii")
-    url = "https://api.harvestapp.com/v2/time_entries"
+def push_harvest_task(data: RemoteHarvestTask, uuid: str):
+    fields = dict(data)
+    fields["external_reference[id]"] = uuid
+    fields["external_reference[group_id]"] = EXTERNAL_REFERENCE_GROUP
+    data_encoded = urllib.parse.urlencode(fields).encode("ascii")
+    url = f"{HARVEST_BASE_URL}/time_entries"
     request = urllib.request.Request(
         url=url, headers=HARVEST_HEADERS, data=data_encoded
     )
-    with urllib.request.urlopen(request, timeout=5) as response:
+    with urlopen(request) as response:
         responseCode = response.getcode()
         if responseCode != 201:
             responseBody = response.read().decode("utf-8")
             jsonResponse = json.loads(responseBody)
             print(json.dumps(jsonResponse, sort_keys=True, indent=2))
             raise Exception(
-                f"Request failed: Couldn't push task {task.uuid} to Harvest."
+                f'Request failed: Couldn\'t push "{data["notes"]}" to Harvest.'
             )
 
 
@@ -180,10 +270,52 @@ def push_task(task):
         "project_id": project_id,
         "task_id": task_id,
     }
-    push_harvest_task(data)
+    push_harvest_task(data, task.uuid)
+
+
+def push_tasks(tasks: List) -> Dict[str, Exception | None]:
+    def push(task):
+        try:
+            push_task(task)
+        except Exception as e:
+            return e
+        return None
 
+    tasks = list(tasks)
+    with ThreadPoolExecutor(max_workers=max(1, HARVEST_PUSH_WORKERS)) as executor:
+        errors = executor.map(push, tasks)
+        return {task.uuid: error for task, error in zip(tasks, errors)}
 
-def pull():
-    pull_weekly_harvest_hours()
-    pull_projects_clients_tasks()
+
+async def fetch_remote_state(
+    user_id: str | None, weeks: List[Week], updated_since: str | None
+):
+    async def fetch_hours():
+        userId = user_id or await asyncio.to_thread(fetch_user_id)
+        return userId, await asyncio.to_thread(fetch_harvest_hours, weeks, userId)
+
+    (userId, hours), assignments = await asyncio.gather(
+        fetch_hours(), get_project_assignments(updated_since)
+    )
+    return userId, hours, assignments
+
+
+def pull(full: bool = False):
+    # Everything is fetched concurrently first, then applied in one transaction.
+    # Nothing is locked while waiting for Harvest: a read snapshot that is kept
+    # would fail the writes if another process committed in the meantime
+    synced_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    with session():
+        updated_since = None if full else get_sync_state(ASSIGNMENTS_SYNCED_AT)
+        user = User.select().first()
+    weeks = [date.today().isocalendar()[:2]]
+    userId, hours, assignments = asyncio.run(
+        fetch_remote_state(user.id if user else None, weeks, updated_since)
+    )
+    with session("IMMEDIATE"):
+        if not user:
+            User.create(id=userId)
+        store_hours(hours)
+        sync_catalog(assignments, full=updated_since is None, synced_at=synced_at)
+        write_catalog_file()
     print("Updated local db + weekly hours.")
@@ -0,0 +1,116 @@
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+from env import HARVEST_HOURS_TTL, TIMETRACK_DB
+from model import HarvestWeekHours
+from utils import get_task_length_in_mins, run_in_background
+
+# Summaries render from the cached hours right away and refresh stale weeks in
+# a detached `task refresh-hours` process.
+
+Week = Tuple[int, int]
+REFRESH_LOCK = Path(f"{TIMETRACK_DB}.refresh-hours.lock")
+REFRESH_LOCK_TIMEOUT = 60
+
+
+def parse_week(value: str) -> Week:
+    year, week = value.split("-W")
+    return int(year), int(week)
+
+
+def format_week(week: Week) -> str:
+    return f"{week[0]}-W{week[1]:02}"
+
+
+def is_stale(entry: HarvestWeekHours | None) -> bool:
+    if not entry or not entry.fetched_at:
+        return True
+    return datetime.now() - entry.fetched_at > timedelta(seconds=HARVEST_HOURS_TTL)
+
+
+def store_hours(hours: Dict[Week, float]):
+    fetched_at = datetime.now()
+    for (year, week), value in hours.items():
+        HarvestWeekHours.replace(
+            year=year, week=week, hours=value, fetched_at=fetched_at
+        ).execute()
+
+
+def add_pushed_tasks(tasks: Iterable):
+    # Count pushed tasks right away and mark the weeks for a refresh
+    hours = defaultdict(float)
+    for task in tasks:
+        year, week, _ = task.start_time.isocalendar()
+        hours[(year, week)] += get_task_length_in_mins(task) / 60
+    for (year, week), value in hours.items():
+        HarvestWeekHours.insert(
+            year=year, week=week, hours=value, fetched_at=None
+        ).on_conflict(
+            conflict_target=[HarvestWeekHours.year, HarvestWeekHours.week],
+            update={
+                HarvestWeekHours.hours: HarvestWeekHours.hours + value,
+                HarvestWeekHours.fetched_at: None,
+            },
+        ).execute()
+    return list(hours)
+
+
+def _acquire_refresh_lock() -> bool:
+    try:
+        if time.time() - REFRESH_LOCK.stat().st_mtime < REFRESH_LOCK_TIMEOUT:
+            return False
+        REFRESH_LOCK.unlink()
+    except FileNotFoundError:
+        pass
+    try:
+        os.close(os.open(REFRESH_LOCK, os.O_CREAT | os.O_EXCL))
+    except FileExistsError:
+        return False
+    return True
+
+
+def release_refresh_lock():
+    REFRESH_LOCK.unlink(missing_ok=True)
+
+
+def refresh_in_background(weeks: List[Week]):
+    if not weeks or not _acquire_refresh_lock():
+        return
+    run_in_background(
+        ["refresh-hours", "--release-lock"] + [format_week(week) for week in weeks]
+    )
+
+
+def get_weeks_hours(weeks: List[Week], blocking: bool = False) -> Dict[Week, float]:
+    first, last = min(weeks), max(weeks)
+    key = HarvestWeekHours.year * 100 + HarvestWeekHours.week
+    entries = {
+        (entry.year, entry.week): entry
+        for entry in HarvestWeekHours.select().where(
+            key.between(first[0] * 100 + first[1], last[0] * 100 + last[1])
+        )
+    }
+    hours = {week: entries[week].hours if week in entries else 0.0 for week in weeks}
+    stale = [week for week in weeks if is_stale(entries.get(week))]
+    if not stale:
+        return hours
+    if blocking:
+        from harvest import pull_harvest_hours
+
+        # Archived weeks are kept, don't write them with outdated hours
+        try:
+            fetched = pull_harvest_hours(stale)
+        except Exception as e:
+            raise RuntimeError(f"Couldn't get hours from Harvest: {e}") from e
+        hours.update({week: fetched[week] for week in stale})
+    else:
+        refresh_in_background(stale)
+    return hours
+
+
+def get_week_hours(year: int, week: int, blocking: bool = False) -> float:
+    return get_weeks_hours([(year, week)], blocking)[(year, week)]
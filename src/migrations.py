@@ -0,0 +1,199 @@
+from datetime import date
+from pathlib import Path
+
+import rollups
+from db_config import db
+from env import TIMETRACK_DB
+from model import (
+    DurationRollup,
+    HarvestClient,
+    HarvestProject,
+    HarvestTask,
+    HarvestUpload,
+    HarvestWeekHours,
+    OutboxEntry,
+    SyncState,
+    Task,
+    TaskName,
+)
+
+
+def _add_task_indexes():
+    Task._schema.create_indexes(safe=True)
+
+
+def _add_duration_rollups():
+    db.create_tables([DurationRollup])
+    rollups.rebuild()
+
+
+def _add_catalog_sync_state():
+    db.create_tables([SyncState])
+    for model in [HarvestClient, HarvestProject, HarvestTask]:
+        model._schema.create_indexes(safe=True)
+
+
+def _add_harvest_week_hours():
+    db.create_tables([HarvestWeekHours])
+    if not db.table_exists("harvest_weeklyhours"):
+        return
+    # The old single-row table held the hours of the week it was pulled in,
+    # keep them for the current week, marked stale
+    row = db.execute_sql("SELECT hours FROM harvest_weeklyhours LIMIT 1").fetchone()
+    if row:
+        year, week, _ = date.today().isocalendar()
+        HarvestWeekHours.insert(
+            year=year, week=week, hours=row[0], fetched_at=None
+        ).on_conflict_ignore().execute()
+    db.execute_sql("DROP TABLE harvest_weeklyhours")
+
+
+def _add_harvest_outbox():
+    db.create_tables([OutboxEntry])
+
+
+def _add_task_change_log():
+    # Was the change log of a columnar copy of `tasks` for `task stats`, which
+    # now queries `tasks`. Kept so that the later steps keep their versions
+    pass
+
+
+_FTS_INSERT = "INSERT INTO tasks_fts (rowid, name) VALUES (new.rowid, new.name);"
+_FTS_DELETE = (
+    "INSERT INTO tasks_fts (tasks_fts, rowid, name) "
+    "VALUES ('delete', old.rowid, old.name);"
+)
+# `save()` writes every column, only a changed name needs a new index entry
+_FTS_UPDATE_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF name ON tasks "
+    f"WHEN old.name IS NOT new.name BEGIN {_FTS_DELETE} {_FTS_INSERT} END"
+)
+
+
+def _add_task_search_index():
+    # External content table: only the index is stored, names are read from
+    # `tasks`. Prefix indexes make `word*` queries as cheap as whole words
+    db.execute_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(name, "
+        "content='tasks', content_rowid='rowid', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    triggers = {
+        "insert": ("INSERT", _FTS_INSERT),
+        "delete": ("DELETE", _FTS_DELETE),
+    }
+    for name, (event, body) in triggers.items():
+        db.execute_sql(
+            f"CREATE TRIGGER IF NOT EXISTS tasks_fts_{name} AFTER {event} ON tasks "
+            f"BEGIN {body} END"
+        )
+    db.execute_sql(_FTS_UPDATE_TRIGGER)
+    db.execute_sql("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+
+
+# Counts a use of `row.name`. The assignment is only taken over from tasks that
+# have one and are at least as recent as the last use
+_TASK_NAME_UPSERT = (
+    "INSERT INTO task_names (name, uses, last_used, projectId, taskId) "
+    "VALUES ({row}.name, 1, {row}.start_time, {row}.projectId, {row}.taskId) "
+    "ON CONFLICT (name) DO UPDATE SET uses = uses + 1, "
+    "last_used = MAX(last_used, excluded.last_used), "
+    "projectId = CASE WHEN excluded.projectId IS NOT NULL "
+    "AND excluded.last_used >= last_used THEN excluded.projectId ELSE projectId END, "
+    "taskId = CASE WHEN excluded.projectId IS NOT NULL "
+    "AND excluded.last_used >= last_used THEN excluded.taskId ELSE taskId END;"
+)
+_TASK_NAME_REMOVE = (
+    "UPDATE task_names SET uses = uses - 1 WHERE name = old.name; "
+    "DELETE FROM task_names WHERE name = old.name AND uses <= 0;"
+)
+
+
+def _add_task_name_suggestions():
+    db.create_tables([TaskName])
+    # `save()` writes every column, the WHEN clauses skip unchanged values
+    triggers = {
+        "insert": ("INSERT", "", _TASK_NAME_UPSERT.format(row="new")),
+        "rename": (
+            "UPDATE OF name",
+            "WHEN old.name IS NOT new.name",
+            _TASK_NAME_REMOVE + " " + _TASK_NAME_UPSERT.format(row="new"),
+        ),
+        "assign": (
+            "UPDATE OF projectId, taskId",
+            "WHEN new.projectId IS NOT NULL AND (old.projectId IS NOT new.projectId "
+            "OR old.taskId IS NOT new.taskId)",
+            "UPDATE task_names SET projectId = new.projectId, taskId = new.taskId "
+            "WHERE name = new.name AND last_used <= new.start_time;",
+        ),
+        "delete": ("DELETE", "", _TASK_NAME_REMOVE),
+    }
+    for name, (event, when, body) in triggers.items():
+        db.execute_sql(
+            f"CREATE TRIGGER IF NOT EXISTS task_names_{name} AFTER {event} ON tasks "
+            f"{when} BEGIN {body} END"
+        )
+    db.execute_sql(
+        "INSERT OR IGNORE INTO task_names (name, uses, last_used) "
+        "SELECT name, COUNT(*), MAX(start_time) FROM tasks GROUP BY name"
+    )
+    # Bare columns next to MAX() come from the row with the maximum
+    db.execute_sql(
+        "UPDATE task_names SET projectId = assigned.projectId, "
+        "taskId = assigned.taskId FROM ("
+        'SELECT name, MAX(start_time), "projectId", "taskId" FROM tasks '
+        'WHERE "projectId" IS NOT NULL GROUP BY name'
+        ") AS assigned WHERE task_names.name = assigned.name"
+    )
+
+
+def _drop_task_change_log():
+    for name in ["insert", "update", "delete"]:
+        db.execute_sql(f"DROP TRIGGER IF EXISTS tasks_log_{name}")
+    db.execute_sql("DROP TABLE IF EXISTS task_changes")
+    for suffix in [".columns", ".columns.lock"]:
+        Path(f"{TIMETRACK_DB}{suffix}").unlink(missing_ok=True)
+
+
+def _add_harvest_uploads():
+    db.create_tables([HarvestUpload])
+
+
+def _skip_unchanged_names_in_search_index():
+    db.execute_sql("DROP TRIGGER IF EXISTS tasks_fts_update")
+    db.execute_sql(_FTS_UPDATE_TRIGGER)
+
+
+# Append new steps at the end, never reorder: the position of a step + 1 is
+# the schema version it upgrades the database to.
+MIGRATIONS = [
+    _add_task_indexes,
+    _add_duration_rollups,
+    _add_catalog_sync_state,
+    _add_harvest_week_hours,
+    _add_harvest_outbox,
+    _add_task_change_log,
+    _add_task_search_index,
+    _add_task_name_suggestions,
+    _drop_task_change_log,
+    _add_harvest_uploads,
+    _skip_unchanged_names_in_search_index,
+]
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version() -> int:
+    return db.execute_sql("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(force: bool = False):
+    version = get_schema_version()
+    if version >= LATEST_VERSION:
+        return
+    if not force and not db.table_exists(Task._meta.table_name):
+        # Database has not been set up yet, `task setup` will take care of it
+        return
+    for step, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with db.atomic():
+            migration()
+            db.execute_sql(f"PRAGMA user_version = {step}")
@@ -14,10 +14,10 @@ class User(pw.Model):
 class Task(pw.Model):
     uuid = pw.CharField(primary_key=True)
     name = pw.CharField()
-    start_time = pw.DateTimeField()
-    end_time = pw.DateTimeField(null=True)
+    start_time = pw.DateTimeField(index=True)
+    end_time = pw.DateTimeField(null=True, index=True)
     name = pw.CharField()
-    is_logged = pw.BooleanField()
+    is_logged = pw.BooleanField(index=True)
     taskId = pw.IntegerField(null=True)
     projectId = pw.IntegerField(null=True)
 
@@ -28,6 +28,37 @@ class Task(pw.Model):
     class Meta:
         database = db
         table_name = "tasks"
+        indexes = ((("projectId", "taskId"), False),)
+
+
+class TaskName(pw.Model):
+    # Filled by triggers on `tasks`, see migrations.py + suggestions.py
+    name = pw.CharField(primary_key=True)
+    uses = pw.IntegerField(default=0)
+    last_used = pw.DateTimeField()
+    # Last Harvest assignment of a task with this name
+    projectId = pw.IntegerField(null=True)
+    taskId = pw.IntegerField(null=True)
+
+    class Meta:
+        database = db
+        table_name = "task_names"
+
+
+class DurationRollup(pw.Model):
+    day = pw.DateField()
+    year = pw.IntegerField()
+    week = pw.IntegerField()
+    # 0 = not assigned, NULL would break the uniqueness of the key
+    projectId = pw.IntegerField(default=0)
+    taskId = pw.IntegerField(default=0)
+    minutes = pw.IntegerField(default=0)
+
+    class Meta:
+        database = db
+        table_name = "duration_rollups"
+        primary_key = pw.CompositeKey("day", "projectId", "taskId")
+        indexes = ((("year", "week"), False),)
 
 
 class LogHistory(pw.Model):
@@ -38,8 +69,18 @@ class LogHistory(pw.Model):
         table_name = "last_logged"
 
 
+class HarvestUpload(pw.Model):
+    # Tasks uploaded by `task push` or the outbox, see outbox.py
+    uuid = pw.CharField(primary_key=True)
+    uploaded_at = pw.DateTimeField()
+
+    class Meta:
+        database = db
+        table_name = "harvest_uploads"
+
+
 class HarvestClient(pw.Model):
-    clientId = pw.IntegerField()
+    clientId = pw.IntegerField(index=True)
     name = pw.CharField()
 
     class Meta:
@@ -48,7 +89,7 @@ class HarvestClient(pw.Model):
 
 
 class HarvestProject(pw.Model):
-    projectId = pw.IntegerField()
+    projectId = pw.IntegerField(index=True)
     client = pw.ForeignKeyField(HarvestClient, backref="projects")
     name = pw.CharField()
 
@@ -66,14 +107,43 @@ class HarvestTask(pw.Model):
     class Meta:
         database = db
         table_name = "harvest_tasks"
+        indexes = ((("project", "taskId"), False),)
 
 
-class HarvestMeta(pw.Model):
-    hours = pw.FloatField(primary_key=True)
+class SyncState(pw.Model):
+    key = pw.CharField(primary_key=True)
+    value = pw.CharField()
+
+    class Meta:
+        database = db
+        table_name = "sync_state"
+
+
+class HarvestWeekHours(pw.Model):
+    year = pw.IntegerField()
+    week = pw.IntegerField()
+    hours = pw.FloatField()
+    # NULL = needs to be fetched again
+    fetched_at = pw.DateTimeField(null=True)
+
+    class Meta:
+        database = db
+        table_name = "harvest_week_hours"
+        primary_key = pw.CompositeKey("year", "week")
+
+
+class OutboxEntry(pw.Model):
+    uuid = pw.CharField(primary_key=True)
+    queued_at = pw.DateTimeField()
+    attempts = pw.IntegerField(default=0)
+    next_attempt_at = pw.DateTimeField(index=True)
+    # Set while an upload is in flight, see outbox.py
+    claimed_at = pw.DateTimeField(null=True)
+    last_error = pw.TextField(null=True)
 
     class Meta:
         database = db
-        table_name = "harvest_weeklyhours"
+        table_name = "harvest_outbox"
 
 
 class DailyTarget(pw.Model):
@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from peewee import chunked
+
+import harvest_hours
+from db_config import session
+from model import HarvestUpload, OutboxEntry, Task
+from statusbar import update_statusbar
+from task_utils import mark_tasks_logged
+from utils import run_in_background
+
+# Finished tasks wait here until they are uploaded to Harvest. Entries are
+# claimed in their own transaction before the upload is sent and removed in the
+# transaction that marks the tasks logged. Uploads carry the task's UUID as
+# external reference, so a task that reached Harvest without being marked (lost
+# response, killed process) is recognized on the next attempt instead of being
+# uploaded again.
+
+BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 3600
+# A claim older than this belongs to a flush that died
+CLAIM_TIMEOUT_SECONDS = 120
+
+
+def get_backoff(attempts: int) -> timedelta:
+    seconds = BACKOFF_SECONDS * 2 ** (attempts - 1)
+    return timedelta(seconds=min(seconds, MAX_BACKOFF_SECONDS))
+
+
+def is_claimable(force: bool = False):
+    now = datetime.now()
+    claimable = OutboxEntry.claimed_at.is_null(True) | (
+        OutboxEntry.claimed_at < now - timedelta(seconds=CLAIM_TIMEOUT_SECONDS)
+    )
+    if not force:
+        claimable &= OutboxEntry.next_attempt_at <= now
+    return claimable
+
+
+def has_due_entries() -> bool:
+    return OutboxEntry.select().where(is_claimable()).exists()
+
+
+def get_entries():
+    return (
+        OutboxEntry.select(OutboxEntry, Task)
+        .join(Task, on=(OutboxEntry.uuid == Task.uuid), attr="task")
+        .order_by(OutboxEntry.queued_at)
+    )
+
+
+def _claim(force: bool) -> List[Task]:
+    # Tasks that were deleted or logged by hand don't need an upload anymore
+    OutboxEntry.delete().where(
+        OutboxEntry.uuid.not_in(Task.select(Task.uuid).where(Task.is_logged == False))
+    ).execute()
+    entries = list(
+        get_entries().where(is_claimable(force) & Task.end_time.is_null(False))
+    )
+    now = datetime.now()
+    for entry in entries:
+        entry.attempts += 1
+        entry.claimed_at = now
+        entry.next_attempt_at = now + get_backoff(entry.attempts)
+    if entries:
+        OutboxEntry.bulk_update(
+            entries,
+            fields=[
+                OutboxEntry.attempts,
+                OutboxEntry.claimed_at,
+                OutboxEntry.next_attempt_at,
+            ],
+            batch_size=100,
+        )
+    return [entry.task for entry in entries]
+
+
+def _finish(tasks: List[Task], errors: Dict[str, Exception | None], undoable: bool):
+    pushed = [task.uuid for task in tasks if errors.get(task.uuid) is None]
+    if pushed:
+        mark_tasks_logged(pushed, undoable)
+        now = datetime.now()
+        for batch in chunked(pushed, 500):
+            OutboxEntry.delete().where(OutboxEntry.uuid.in_(batch)).execute()
+            HarvestUpload.insert_many(
+                [(uuid, now) for uuid in batch],
+                fields=[HarvestUpload.uuid, HarvestUpload.uploaded_at],
+            ).on_conflict_ignore().execute()
+    for uuid, error in errors.items():
+        if error is not None:
+            OutboxEntry.update(claimed_at=None, last_error=str(error)).where(
+                OutboxEntry.uuid == uuid
+            ).execute()
+    # Tasks that were found in Harvest are already part of its hours
+    uploaded = [
+        task for task in tasks if task.uuid in errors and errors[task.uuid] is None
+    ]
+    return harvest_hours.add_pushed_tasks(uploaded)
+
+
+# Returns the claimed tasks + the errors of those that failed. `force` ignores
+# the backoff of entries that failed before, `undoable` lets `task unlog` reset
+# the uploaded tasks (`task push`)
+def flush(
+    force: bool = False, undoable: bool = False
+) -> Tuple[List[Task], Dict[str, Exception]]:
+    from harvest import get_uploaded_uuids, get_user_id, push_tasks
+
+    with session("IMMEDIATE"):
+        tasks = _claim(force)
+        if not tasks:
+            return [], {}
+        user_id = get_user_id()
+
+    try:
+        uploaded = get_uploaded_uuids(tasks, user_id)
+    except Exception as e:
+        errors = {task.uuid: e for task in tasks}
+    else:
+        errors = push_tasks([task for task in tasks if task.uuid not in uploaded])
+
+    with session("IMMEDIATE"):
+        weeks = _finish(tasks, errors, undoable)
+        update_statusbar()
+    harvest_hours.refresh_in_background(weeks)
+
+    failed = {uuid: error for uuid, error in errors.items() if error is not None}
+    return tasks, failed
+
+
+def flush_in_background():
+    if has_due_entries():
+        run_in_background(["flush"])
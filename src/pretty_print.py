@@ -7,10 +7,11 @@ from rich.panel import Panel
 from rich.table import Table
 from rich.text import Text
 
-from calendar_utils import get_week_string
+import harvest_hours
+import rollups
+from calendar_utils import get_week_string, today_range
 from env import HOURS
-from model import DailyTarget, HarvestMeta, Preset, Task
-from utils import get_task_lengths_in_mins
+from model import DailyTarget, Preset, Task
 
 
 def _hours_to_hhmm_string(hours: float, color: bool = True) -> str:
@@ -25,11 +26,12 @@ def _hours_to_hhmm_string(hours: float, color: bool = True) -> str:
         return f"{open_hours}:{minutes:02}{post_indicator}"
 
 
-def show_daily_summary(tasksToday: List[Task], tasksUnlogged: List[Task]):
-    hours_harvest = HarvestMeta.select().limit(1)[0].hours
-    hours_unlogged = get_task_lengths_in_mins(tasksUnlogged) / 60
+def show_daily_summary(tasksToday: List[Task], unloggedMinutes: int):
+    year, week, _ = datetime.today().date().isocalendar()
+    hours_harvest = harvest_hours.get_week_hours(year, week)
+    hours_unlogged = unloggedMinutes / 60
     hours_worked = hours_harvest + hours_unlogged
-    hours_today = get_task_lengths_in_mins(tasksToday) / 60
+    hours_today = rollups.get_tracked_minutes(today_range()) / 60
 
     weekly_table = Table(header_style="green", show_edge=False)
     weekly_table.add_column("")
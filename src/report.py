@@ -0,0 +1,131 @@
+import csv
+import json
+import sys
+from datetime import date, datetime
+from typing import Dict, List
+
+from peewee import SQL, fn
+
+from model import HarvestClient, HarvestProject, HarvestTask, Task
+from task_utils import filter_tasks, join_catalog
+
+# Durations are summed by SQLite, only one row per group comes back.
+
+# Grouped by Harvest ID, names with the same ID are the same
+REPORT_GROUPS = {
+    "client": (HarvestClient.clientId, HarvestClient.name),
+    "project": (Task.projectId, HarvestProject.name),
+    "task": (Task.taskId, HarvestTask.name),
+}
+REPORT_BUCKETS = {
+    "day": lambda start: fn.date(start).coerce(False),
+    # Monday of the ISO week, labelled in Python
+    "week": lambda start: fn.date(start, "weekday 0", "-6 days").coerce(False),
+    "month": lambda start: fn.strftime("%Y-%m", start).coerce(False),
+}
+
+
+def _epoch(value):
+    return fn.strftime("%s", value).cast("INTEGER")
+
+
+def get_report(
+    since: date | None = None,
+    until: date | None = None,
+    groups: List[str] = ("client", "project"),
+    bucket: str | None = None,
+    logged: bool | None = None,
+    project: str | None = None,
+) -> List[Dict]:
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # Whole minutes per task like `get_task_length_in_mins`, running tasks
+    # count up to now
+    minutes = (_epoch(fn.IFNULL(Task.end_time, now)) - _epoch(Task.start_time)) / 60
+    columns = []
+    keys = []
+    if bucket:
+        keys.append(REPORT_BUCKETS[bucket](Task.start_time))
+        columns.append(keys[-1].alias("bucket"))
+    for group in groups:
+        id, name = REPORT_GROUPS[group]
+        keys.append(id)
+        # A task ID without its project has no name in the join
+        columns += [id.alias(f"{group}_id"), fn.MAX(name).alias(group)]
+    query = join_catalog(
+        Task.select(
+            *columns,
+            fn.SUM(minutes).alias("minutes"),
+            fn.COUNT(Task.uuid).alias("tasks"),
+        )
+    )
+    if logged is not None:
+        query = query.where(Task.is_logged == logged)
+    query = filter_tasks(query, since, until, project)
+    rows = list(
+        query.group_by(*keys)
+        .order_by(*keys[: 1 if bucket else 0], SQL('"minutes"').desc())
+        .dicts()
+    )
+    for row in rows:
+        if bucket == "week":
+            year, week, _ = date.fromisoformat(row["bucket"]).isocalendar()
+            row["bucket"] = f"{year}-W{week:02}"
+        row["hours"] = round(row["minutes"] / 60, 2)
+    return rows
+
+
+def _label(row: Dict, group: str) -> str:
+    if row[group] is not None:
+        return row[group]
+    # Not in the local catalog (yet), e.g. before the next `pull`
+    return "Not assigned" if row[f"{group}_id"] is None else str(row[f"{group}_id"])
+
+
+def show_report(format: str = "table", **options):
+    rows = get_report(**options)
+    groups = list(options.get("groups") or REPORT_GROUPS)
+    bucket = options.get("bucket")
+    fields = (["bucket"] if bucket else []) + groups + ["hours", "tasks"]
+    match format:
+        case "json":
+            print(json.dumps(rows, indent=2, ensure_ascii=False))
+        case "csv":
+            writer = csv.writer(sys.stdout)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow(
+                    [_label(row, f) if f in groups else row[f] for f in fields]
+                )
+        case "table":
+            from rich.console import Console
+            from rich.table import Table
+
+            if not rows:
+                print("No tasks found.")
+                return
+            table = Table(header_style="green", show_edge=False, show_footer=True)
+            for field in fields:
+                footer = ""
+                if field == "hours":
+                    footer = f"{sum(row['minutes'] for row in rows) / 60:.2f}"
+                elif field == "tasks":
+                    footer = str(sum(row["tasks"] for row in rows))
+                elif field == fields[0]:
+                    footer = "Total"
+                table.add_column(
+                    field.capitalize(),
+                    footer=footer,
+                    justify="right" if field in ("hours", "tasks") else "left",
+                )
+            for row in rows:
+                table.add_row(
+                    *[
+                        _label(row, f)
+                        if f in groups
+                        else f"{row[f]:.2f}"
+                        if f == "hours"
+                        else str(row[f])
+                        for f in fields
+                    ]
+                )
+            Console().print(table)
@@ -0,0 +1,113 @@
+from collections import defaultdict
+from datetime import datetime
+from peewee import EXCLUDED, chunked, fn
+
+from calendar_utils import DateRange
+from model import DurationRollup, Task
+from utils import get_task_length_in_mins
+
+# Rollups only cover finished tasks, the running task is added on read.
+
+
+def _get_key(task: Task) -> tuple:
+    day = task.start_time.date()
+    year, week, _ = day.isocalendar()
+    return day, year, week, task.projectId or 0, task.taskId or 0
+
+
+def _apply(task: Task, sign: int):
+    if task.end_time is None:
+        return
+    day, year, week, projectId, taskId = _get_key(task)
+    minutes = sign * get_task_length_in_mins(task)
+    DurationRollup.insert(
+        day=day,
+        year=year,
+        week=week,
+        projectId=projectId,
+        taskId=taskId,
+        minutes=minutes,
+    ).on_conflict(
+        conflict_target=[
+            DurationRollup.day,
+            DurationRollup.projectId,
+            DurationRollup.taskId,
+        ],
+        update={DurationRollup.minutes: DurationRollup.minutes + EXCLUDED.minutes},
+    ).execute()
+
+
+def add_task(task: Task):
+    _apply(task, 1)
+
+
+def remove_task(task: Task):
+    _apply(task, -1)
+
+
+def _get_running_minutes(date_range: DateRange) -> int:
+    start, end = date_range
+    running = Task.select().where(
+        Task.end_time.is_null(True)
+        & (Task.start_time >= start)
+        & (Task.start_time < end)
+    )
+    return sum(get_task_length_in_mins(task) for task in running)
+
+
+def get_tracked_minutes(date_range: DateRange, includeRunning=True) -> int:
+    start, end = date_range
+    minutes = (
+        DurationRollup.select(fn.SUM(DurationRollup.minutes))
+        .where((DurationRollup.day >= start.date()) & (DurationRollup.day < end.date()))
+        .scalar()
+    )
+    if not includeRunning:
+        return minutes or 0
+    return (minutes or 0) + _get_running_minutes(date_range)
+
+
+def _epoch(value):
+    return fn.strftime("%s", value).cast("INTEGER")
+
+
+def get_unlogged_minutes() -> int:
+    # Not in the rollups, which don't know what is logged. Summed by SQLite in
+    # whole minutes per task like `get_task_length_in_mins`, running tasks count
+    # up to now
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    seconds = _epoch(fn.IFNULL(Task.end_time, now)) - _epoch(Task.start_time)
+    minutes = Task.select(fn.SUM(seconds / 60)).where(Task.is_logged == False).scalar()
+    return minutes or 0
+
+
+def _compute_rollups() -> dict:
+    rollups = defaultdict(int)
+    for task in Task.select().where(Task.end_time.is_null(False)).iterator():
+        rollups[_get_key(task)] += get_task_length_in_mins(task)
+    return rollups
+
+
+def rebuild() -> int:
+    expected = {key: mins for key, mins in _compute_rollups().items() if mins}
+    stored = {
+        (row.day, row.year, row.week, row.projectId, row.taskId): row.minutes
+        for row in DurationRollup.select()
+        if row.minutes
+    }
+    mismatches = sum(
+        expected.get(key) != stored.get(key) for key in expected.keys() | stored.keys()
+    )
+    DurationRollup.delete().execute()
+    rows = [(*key, minutes) for key, minutes in expected.items()]
+    fields = [
+        DurationRollup.day,
+        DurationRollup.year,
+        DurationRollup.week,
+        DurationRollup.projectId,
+        DurationRollup.taskId,
+        DurationRollup.minutes,
+    ]
+    for batch in chunked(rows, 100):
+        DurationRollup.insert_many(batch, fields=fields).execute()
+    return mismatches
@@ -0,0 +1,63 @@
+import re
+from datetime import date
+from typing import List
+
+from peewee import SQL
+
+from model import Task
+from task_utils import filter_tasks
+
+# `task search` reads the FTS5 index `tasks_fts`, kept in sync with the names
+# in `tasks` by triggers, see migrations.py.
+
+OPERATORS = {"AND", "OR", "NOT"}
+TOKEN = re.compile(r'"([^"]*)"|(\S+)')
+
+
+# Bare words match as prefixes (`rev` finds "review"), quoted text as a
+# phrase, AND/OR/NOT are passed on. Everything else is quoted, so characters
+# with a meaning in FTS5 (`-`, `:`, `(`, ...) are searched for literally.
+def to_match_query(text: str) -> str:
+    terms = []
+    for phrase, word in TOKEN.findall(text):
+        if word in OPERATORS:
+            terms.append(word)
+        elif phrase:
+            terms.append('"' + phrase.replace('"', '""') + '"')
+        elif word:
+            terms.append('"' + word.replace('"', '""') + '"*')
+    return " ".join(terms)
+
+
+def search_tasks(
+    text: str,
+    since: date | None = None,
+    until: date | None = None,
+    project: str | None = None,
+    limit: int | None = 50,
+) -> List[Task]:
+    match = to_match_query(text)
+    assert match, "Nothing to search for"
+    query = Task.select().where(
+        SQL(
+            "rowid IN (SELECT rowid FROM tasks_fts WHERE tasks_fts MATCH ?)",
+            [match],
+        )
+    )
+    # Most recent first
+    query = filter_tasks(query, since, until, project).order_by(Task.start_time.desc())
+    if limit:
+        query = query.limit(limit)
+    return list(query)
+
+
+# One entry per name + assignment, the most recent one
+def get_distinct_tasks(tasks: List[Task]) -> List[Task]:
+    seen = set()
+    distinct = []
+    for task in tasks:
+        key = (task.name, task.projectId, task.taskId)
+        if key not in seen:
+            seen.add(key)
+            distinct.append(task)
+    return distinct
@@ -0,0 +1,130 @@
+import json
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict
+
+from peewee import fn
+
+from model import HarvestClient, HarvestProject, Task
+from task_utils import filter_tasks
+
+# Long-range statistics. SQLite sums the durations per hour (by start time) and
+# project, only those sums are added up to the histograms in Python.
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+BAR_WIDTH = 30
+
+
+def compute_stats(
+    since: date | None = None,
+    until: date | None = None,
+    project: str | None = None,
+    trend: str = "month",
+) -> Dict:
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # Running tasks count up to now
+    seconds = (
+        fn.julianday(fn.IFNULL(Task.end_time, now)) - fn.julianday(Task.start_time)
+    ) * 86400
+    # "YYYY-MM-DD HH" prefix of the stored start time, cheaper to group by
+    # than date() + strftime()
+    dayHour = fn.substr(Task.start_time, 1, 13).coerce(False)
+    query = filter_tasks(
+        Task.select(dayHour, Task.projectId, fn.COUNT(Task.uuid), fn.SUM(seconds)),
+        since,
+        until,
+        project,
+    ).group_by(dayHour, Task.projectId)
+
+    tasks = 0
+    hours = [0] * 24
+    days = defaultdict(float)
+    projects = defaultdict(float)
+    for key, projectId, count, seconds in query.tuples().iterator():
+        tasks += count
+        days[key[:10]] += seconds
+        hours[int(key[11:])] += seconds
+        projects[projectId] += seconds
+
+    weekdays = [0] * 7
+    periods = defaultdict(float)
+    for day, seconds in days.items():
+        dayDate = date.fromisoformat(day)
+        weekdays[dayDate.weekday()] += seconds
+        if trend == "week":
+            year, week, _ = dayDate.isocalendar()
+            periods[f"{year}-W{week:02}"] += seconds
+        else:
+            periods[dayDate.strftime("%Y-%m")] += seconds
+
+    names = {
+        p.projectId: f"{p.client.name} / {p.name}"
+        for p in HarvestProject.select(HarvestProject, HarvestClient)
+        .join(HarvestClient)
+        .where(HarvestProject.projectId.in_(list(projects)))
+    }
+    return {
+        "tasks": tasks,
+        "hours": round(sum(days.values()) / 3600, 2),
+        "first_day": min(days) if days else None,
+        "last_day": max(days) if days else None,
+        "weekdays": {
+            name: round(seconds / 3600, 2) for name, seconds in zip(WEEKDAYS, weekdays)
+        },
+        "hours_of_day": {
+            f"{hour:02}": round(seconds / 3600, 2) for hour, seconds in enumerate(hours)
+        },
+        "projects": {
+            names.get(projectId, "Not assigned" if not projectId else str(projectId)): (
+                round(seconds / 3600, 2)
+            )
+            for projectId, seconds in sorted(
+                projects.items(), key=lambda item: item[1], reverse=True
+            )
+        },
+        "trend": {
+            period: round(seconds / 3600, 2)
+            for period, seconds in sorted(periods.items())
+        },
+    }
+
+
+def _format_histogram(title: str, values: Dict[str, float]) -> str:
+    output = f"\n{title}\n"
+    if not values:
+        return output
+    width = max(len(label) for label in values)
+    top = max(values.values()) or 1
+    for label, hours in values.items():
+        bar = "█" * round(hours / top * BAR_WIDTH)
+        output += f"  {label:<{width}}  {bar:<{BAR_WIDTH}} {hours:8.1f} h\n"
+    return output
+
+
+def format_stats(stats: Dict, top: int = 10) -> str:
+    if not stats["tasks"]:
+        return "No tasks found."
+    output = (
+        f"{stats['hours']:.1f} h in {stats['tasks']} tasks, "
+        f"{stats['first_day']} - {stats['last_day']}\n"
+    )
+    output += _format_histogram("Weekday", stats["weekdays"])
+    output += _format_histogram(
+        "Hour of day (start)",
+        {hour: value for hour, value in stats["hours_of_day"].items() if value},
+    )
+    output += _format_histogram(
+        f"Top {top} projects", dict(list(stats["projects"].items())[:top])
+    )
+    output += _format_histogram("Trend", stats["trend"])
+    return output
+
+
+def show_stats(
+    since=None, until=None, project=None, trend="month", top=10, asJson=False
+):
+    stats = compute_stats(since, until, project, trend)
+    if asJson:
+        print(json.dumps(stats, indent=2, ensure_ascii=False))
+    else:
+        print(format_stats(stats, top))
@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+from datetime import date, datetime
+from pathlib import Path
+
+import rollups
+from calendar_utils import iso_week_range, today_range
+from env import STATUSBAR_FILE, STATUSBAR_FORMATS
+from model import Task
+from task_utils import get_running_task
+
+# Totals only cover finished tasks, so that status bars can add the running
+# task's time since `start_epoch` themselves without calling `task`.
+
+
+def get_snapshot() -> dict:
+    task = get_running_task()
+    year, week, _ = date.today().isocalendar()
+    unlogged = Task.select().where(
+        (Task.is_logged == False) & (Task.end_time.is_null(False))
+    )
+    return {
+        "running": task is not None,
+        "name": task.name if task else None,
+        "start_epoch": int(task.start_time.timestamp()) if task else None,
+        "day": date.today().isoformat(),
+        "today_minutes": rollups.get_tracked_minutes(
+            today_range(), includeRunning=False
+        ),
+        "week": f"{year}-W{week:02}",
+        "week_minutes": rollups.get_tracked_minutes(
+            iso_week_range(year, week), includeRunning=False
+        ),
+        "unlogged_count": unlogged.count(),
+    }
+
+
+def _get_text(snapshot: dict) -> str:
+    if not snapshot["running"]:
+        return ""
+    start_time = datetime.fromtimestamp(snapshot["start_epoch"])
+    return snapshot["name"] + " since " + start_time.strftime("%-H:%M")
+
+
+def _format(snapshot: dict, text: str, fmt: str) -> str:
+    match fmt:
+        case "json":
+            return json.dumps(snapshot)
+        case "i3bar":
+            return json.dumps({"name": "timetrack", "full_text": text})
+        case "waybar":
+            today = snapshot["today_minutes"]
+            return json.dumps(
+                {
+                    "text": text,
+                    "tooltip": f"Today: {today // 60}:{today % 60:02}, "
+                    f"{snapshot['unlogged_count']} unlogged",
+                    "class": "running" if snapshot["running"] else "idle",
+                }
+            )
+        case _:
+            raise ValueError(f"Unknown statusbar format {fmt}.")
+
+
+def _write_atomically(path: Path, content: str):
+    try:
+        if path.read_text() == content:
+            return
+    except FileNotFoundError:
+        pass
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def update_statusbar():
+    snapshot = get_snapshot()
+    text = _get_text(snapshot)
+    _write_atomically(STATUSBAR_FILE, text)
+    for fmt in filter(None, STATUSBAR_FORMATS):
+        if fmt == "json":
+            path = Path(f"{STATUSBAR_FILE}.json")
+        else:
+            path = Path(f"{STATUSBAR_FILE}.{fmt}.json")
+        _write_atomically(path, _format(snapshot, text, fmt))
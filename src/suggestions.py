@@ -0,0 +1,25 @@
+from datetime import datetime
+from typing import List
+
+from model import TaskName
+
+# Task names for `task start`, kept up to date by triggers on `tasks`, see
+# migrations.py. Ranked by uses, each week since the last use halves the
+# weight of a name. Ranked in Python: SQLite only has pow() when it was built
+# with the math functions.
+
+HALF_LIFE_DAYS = 7
+MAX_SUGGESTIONS = 500
+
+
+def get_score(name: TaskName, now: datetime) -> float:
+    days = max((now - name.last_used).total_seconds() / 86400, 0)
+    return name.uses / 2 ** (days / HALF_LIFE_DAYS)
+
+
+def get_suggestions(limit: int = MAX_SUGGESTIONS) -> List[TaskName]:
+    now = datetime.now()
+    names = sorted(
+        TaskName.select(), key=lambda name: get_score(name, now), reverse=True
+    )
+    return names[:limit]
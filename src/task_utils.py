@@ -1,29 +1,156 @@
-from utils import get_short_uuid
-from model import Task
-from datetime import datetime
+from typing import Iterable, List, Set
+
+from peewee import JOIN, chunked
+
+import rollups
+from db_config import db
+from env import HARVEST_FLUSH_DELAY
+from utils import ask, get_short_uuid
+from model import (
+    HarvestClient,
+    HarvestProject,
+    HarvestTask,
+    HarvestUpload,
+    LogHistory,
+    OutboxEntry,
+    Task,
+)
+from datetime import date, datetime, timedelta
+from calendar_utils import DateRange, day_range
 
 
 def is_task_running():
     return Task.select().where(Task.end_time.is_null(True)).exists()
 
 
+def get_running_task() -> Task | None:
+    return (
+        Task.select()
+        .where(Task.end_time.is_null(True))
+        .order_by(Task.start_time.desc())
+        .first()
+    )
+
+
 def get_last_task() -> Task:
     return Task.select().order_by(Task.start_time.desc()).limit(1)[0]
 
 
+# Changes to a task that was uploaded would never reach Harvest. Tasks that are
+# only marked logged (`task log`) can still be changed
+def assert_not_uploaded(task: Task):
+    uploaded = HarvestUpload.select().where(HarvestUpload.uuid == task.uuid).exists()
+    assert not uploaded, (
+        f'"{task.name}" was already uploaded to Harvest, change it there instead'
+    )
+
+
+def get_tasks_in_range(date_range: DateRange):
+    start, end = date_range
+    return (
+        Task.select()
+        .where((Task.start_time >= start) & (Task.start_time < end))
+        .order_by(Task.start_time)
+    )
+
+
+def get_project_ids(project: str) -> Set[int]:
+    # Harvest project ID or name
+    if project.isdigit():
+        return {int(project)}
+    return {
+        p.projectId
+        for p in HarvestProject.select(HarvestProject.projectId).where(
+            HarvestProject.name == project
+        )
+    }
+
+
+def filter_tasks(
+    query,
+    since: date | None = None,
+    until: date | None = None,
+    project: str | None = None,
+):
+    if since:
+        query = query.where(Task.start_time >= day_range(since)[0])
+    if until:
+        query = query.where(Task.start_time < day_range(until)[1])
+    if project:
+        query = query.where(Task.projectId.in_(list(get_project_ids(project))))
+    return query
+
+
+# Left joins, so that tasks without (known) Harvest assignment are kept
+def join_catalog(query):
+    return (
+        query.join(
+            HarvestProject,
+            JOIN.LEFT_OUTER,
+            on=(Task.projectId == HarvestProject.projectId),
+        )
+        .join(
+            HarvestClient,
+            JOIN.LEFT_OUTER,
+            on=(HarvestProject.client == HarvestClient.id),
+        )
+        .switch(Task)
+        .join(
+            HarvestTask,
+            JOIN.LEFT_OUTER,
+            on=(HarvestTask.project == HarvestProject.id)
+            & (HarvestTask.taskId == Task.taskId),
+        )
+    )
+
+
+# `undoable`: replace what `task unlog` resets, only for an explicit log/push
+def mark_tasks_logged(uuids: List[str], undoable: bool = True):
+    with db.atomic():
+        if undoable:
+            LogHistory.delete().execute()
+        for batch in chunked(uuids, 500):
+            Task.update(is_logged=True).where(Task.uuid.in_(batch)).execute()
+            if undoable:
+                LogHistory.insert_many(
+                    [(uuid,) for uuid in batch], fields=[LogHistory.uuid]
+                ).execute()
+
+
+def queue_for_upload(tasks: Iterable[Task]):
+    now = datetime.now()
+    # Time to split/edit/assign the task before it is uploaded, `task push`
+    # doesn't wait
+    due = now + timedelta(seconds=HARVEST_FLUSH_DELAY)
+    rows = [
+        {"uuid": task.uuid, "queued_at": now, "next_attempt_at": due}
+        for task in tasks
+        if task.end_time and not task.is_logged
+    ]
+    # A task that was queued before (split, extended and stopped again) waits
+    # for the full delay again
+    for batch in chunked(rows, 500):
+        OutboxEntry.insert_many(batch).on_conflict(
+            conflict_target=[OutboxEntry.uuid],
+            preserve=[OutboxEntry.queued_at, OutboxEntry.next_attempt_at],
+        ).execute()
+
+
 def stop_task():
     assert is_task_running(), "No task currently running!"
 
     task = get_last_task()
     task.end_time = datetime.now()
     task.save()
+    rollups.add_task(task)
+    queue_for_upload([task])
 
     diff_mins = int(((datetime.now() - task.start_time).total_seconds()) / 60)
     print(f'Ended "{task.name}" (ran for {diff_mins} mins).')
 
 
 def start_task(taskId=None, projectId=None, stopPrevious=False, taskName=None):
-    name = taskName or input("Name? ")
+    name = taskName or ask("Name? ")
     if is_task_running():
         if stopPrevious:
             stop_task()
@@ -0,0 +1,78 @@
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Collects per-command counters for `--trace` and query budgets. Only the
+# standard library may be imported here, it's loaded by `db_config`.
+
+
+class Trace:
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.http_requests = 0
+        self.http_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def report(self) -> str:
+        return (
+            f"wall {self.wall_seconds * 1000:.1f} ms | "
+            f"{self.queries} queries, {self.sql_seconds * 1000:.1f} ms SQL | "
+            f"{self.http_requests} HTTP requests, {self.http_seconds * 1000:.1f} ms"
+        )
+
+
+_traces = []
+
+
+def record_query(seconds: float):
+    for current in _traces:
+        with current.lock:
+            current.queries += 1
+            current.sql_seconds += seconds
+
+
+def record_http(seconds: float):
+    for current in _traces:
+        with current.lock:
+            current.http_requests += 1
+            current.http_seconds += seconds
+
+
+@contextmanager
+def trace(label: str | None = None):
+    current = Trace()
+    _traces.append(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.wall_seconds = time.perf_counter() - start
+        _traces.remove(current)
+        if label:
+            sys.stderr.write(f"[{label}] {current.report()}\n")
+
+
+@contextmanager
+def assert_max_queries(budget: int):
+    with trace() as current:
+        yield current
+    assert current.queries <= budget, (
+        f"Ran {current.queries} queries, budget is {budget}."
+    )
+
+
+@contextmanager
+def profile(path: str):
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        sys.stderr.write(f"Wrote profile to {path}\n")
@@ -1,8 +1,14 @@
+import os
+import shlex
 import subprocess
+import sys
 import uuid
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, List
+from pathlib import Path
+from typing import Dict, List, Tuple
 
+from db_config import waiting
 from model import Task
 
 
@@ -18,8 +24,7 @@ def get_task_lengths_in_mins(tasks: List[Task]):
     return sum([get_task_length_in_mins(task) for task in tasks])
 
 
-def fzf(input: Dict, prompt=None) -> str:
-    fzfInput = "\n".join([str(key) + ":" + str(val) for key, val in input.items()])
+def _fzf_cmd_line(prompt=None) -> List[str]:
     cmd_line = ["fzf-tmux"]
     if prompt:
         cmd_line.append(f'--prompt="{prompt} "')
@@ -32,16 +37,97 @@ def fzf(input: Dict, prompt=None) -> str:
     cmd_line.append('--height=40%')
     cmd_line.append('--border')
     cmd_line.append('--padding=1')
-    val = subprocess.run(
-        cmd_line,
-        input=fzfInput,
-        text=True,
-        capture_output=True,
-    ).stdout.strip()
+    return cmd_line
+
+
+def ask(prompt: str) -> str:
+    with waiting():
+        return input(prompt)
+
+
+def fzf(input: Dict, prompt=None) -> str:
+    fzfInput = "\n".join([str(key) + ":" + str(val) for key, val in input.items()])
+    with waiting():
+        val = subprocess.run(
+            _fzf_cmd_line(prompt),
+            input=fzfInput,
+            text=True,
+            capture_output=True,
+        ).stdout.strip()
     if not val:
         raise KeyboardInterrupt("Aborted or `fzf` failed.")
     return val.split(":")[0]
 
 
+# Returns the typed query + the key of the selected line, None if the query
+# didn't match anything or was accepted as is with alt-enter
+def fzf_with_query(input: Dict, prompt=None) -> Tuple[str, str | None]:
+    fzfInput = "\n".join([str(key) + ":" + str(val) for key, val in input.items()])
+    cmd_line = _fzf_cmd_line(prompt)
+    cmd_line.append("--print-query")
+    cmd_line.append("--bind=alt-enter:print-query")
+    cmd_line.append("--header=alt-enter: use the typed name")
+    with waiting():
+        result = subprocess.run(
+            cmd_line,
+            input=fzfInput,
+            text=True,
+            capture_output=True,
+        )
+    lines = result.stdout.split("\n")
+    query = lines[0].strip()
+    selected = lines[1].strip() if len(lines) > 1 else ""
+    if result.returncode == 130 or not (query or selected):
+        raise KeyboardInterrupt("Aborted or `fzf` failed.")
+    return query, selected.split(":")[0] if selected else None
+
+
 def get_short_uuid():
     return str(uuid.uuid4())[:8]
+
+
+def run_in_background(args: List[str]):
+    # Detached `task` subcommand, outlives the current invocation
+    app = Path(__file__).resolve().parent / "app.py"
+    subprocess.Popen(
+        [sys.executable, str(app), "-q"] + args,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+@contextmanager
+def ignore_broken_pipe():
+    # The reader stopped early (`| head`), end the output quietly. Also points
+    # stdout at /dev/null, flushing it on exit would fail again otherwise
+    try:
+        yield
+        sys.stdout.flush()
+    except BrokenPipeError:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+
+
+@contextmanager
+def pager(enabled: bool = True):
+    # Lines are passed on as they are written, nothing is collected first
+    if not enabled or not sys.stdout.isatty():
+        with ignore_broken_pipe():
+            yield sys.stdout
+        return
+    process = subprocess.Popen(
+        shlex.split(os.getenv("PAGER", "less -FRX")), stdin=subprocess.PIPE, text=True
+    )
+    try:
+        yield process.stdin
+    except BrokenPipeError:
+        # Pager was closed before reading everything
+        pass
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        process.wait()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# Benchmarks the code paths of the `task` subcommands on a generated database.
+# Harvest and `fzf` are stubbed, nothing leaves the machine.
+#
+#   python tools/bench.py --years 5 --output bench.json
+#   python tools/bench.py --years 5 --compare bench.json
+
+import argparse
+import builtins
+import contextlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+TASK_NAMES = [
+    "Code review",
+    "Standup",
+    "Planning",
+    "Bugfix",
+    "Feature work",
+    "Support",
+    "Documentation",
+    "Refactoring",
+    "Meeting",
+    "Deployment",
+]
+
+# Queries per benchmark run. They must not grow with the size of the database,
+# a run over budget usually means a query per row (N+1) snuck in.
+QUERY_BUDGETS = {
+    "task": 8,
+    "show_today": 4,
+    "show_week": 6,
+    "show_unlogged": 2,
+    "show_all_page": 1,
+    "get_weeks_tasks": 1,
+    "archive": 4,
+    "archive_all": 4,
+    "export": 1,
+    "stats": 2,
+    "report": 1,
+    "search": 1,
+    "search_all": 1,
+    "log": 8,
+    "push": 21,
+    "assign": 8,
+    "start": 8,
+    "preset_start": 8,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark `task` subcommands")
+    parser.add_argument("--years", type=float, default=3, help="History to generate")
+    parser.add_argument("--tasks-per-day", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--projects-per-client", type=int, default=4)
+    parser.add_argument("--tasks-per-project", type=int, default=6)
+    parser.add_argument("--presets", type=int, default=20)
+    parser.add_argument("--unlogged-days", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--runs", type=int, default=5, help="Runs per benchmark")
+    parser.add_argument(
+        "--db", help="Reuse/keep this database instead of a temporary one"
+    )
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Results JSON of a previous run")
+    parser.add_argument(
+        "benchmarks", nargs="*", help="Only run these benchmarks (default: all)"
+    )
+    return parser.parse_args()
+
+
+def generate(args):
+    from peewee import chunked
+
+    import rollups
+    from db_config import db
+    from model import (
+        HarvestClient,
+        HarvestProject,
+        HarvestTask,
+        HarvestWeekHours,
+        Preset,
+        Task,
+    )
+
+    rng = random.Random(args.seed)
+    catalog = []
+    with db.atomic():
+        year, week, _ = datetime.now().isocalendar()
+        HarvestWeekHours.create(
+            year=year, week=week, hours=12.5, fetched_at=datetime.now()
+        )
+        for c in range(args.clients):
+            client = HarvestClient.create(clientId=1000 + c, name=f"Client {c}")
+            for p in range(args.projects_per_client):
+                projectId = 10000 + c * 100 + p
+                project = HarvestProject.create(
+                    projectId=projectId, client=client, name=f"Project {c}.{p}"
+                )
+                for t in range(args.tasks_per_project):
+                    task = HarvestTask.create(
+                        taskId=100 + t, project=project, client=client, name=f"Task {t}"
+                    )
+                    catalog.append((client, project, task))
+        for i in range(args.presets):
+            client, project, task = rng.choice(catalog)
+            Preset.create(
+                uuid=f"p{i:07}",
+                name=f"Preset {i}",
+                client=client.name,
+                project=project.name,
+                task=task.name,
+            )
+
+        now = datetime.now().replace(second=0, microsecond=0)
+        first_day = (now - timedelta(days=int(args.years * 365))).date()
+        unlogged_from = (now - timedelta(days=args.unlogged_days)).date()
+        rows = []
+        day = first_day
+        while day < now.date():
+            if day.weekday() < 5:
+                start = datetime.combine(day, datetime.min.time()) + timedelta(hours=8)
+                for _ in range(rng.randint(1, 2 * args.tasks_per_day - 1)):
+                    length = timedelta(minutes=rng.randint(5, 90))
+                    _, project, task = rng.choice(catalog)
+                    rows.append(
+                        {
+                            "uuid": f"{len(rows):08x}",
+                            "name": rng.choice(TASK_NAMES),
+                            "start_time": start,
+                            "end_time": start + length,
+                            "is_logged": day < unlogged_from,
+                            "taskId": task.taskId,
+                            "projectId": project.projectId,
+                        }
+                    )
+                    start += length + timedelta(minutes=rng.randint(0, 20))
+            day += timedelta(days=1)
+        for batch in chunked(rows, 100):
+            Task.insert_many(batch).execute()
+        rollups.rebuild()
+    return len(rows)
+
+
+def setup_database(args):
+    from db_config import db
+    from migrations import migrate
+    import model
+
+    models = [
+        m
+        for m in vars(model).values()
+        if isinstance(m, type)
+        and issubclass(m, model.pw.Model)
+        and m is not model.pw.Model
+    ]
+    db.connect()
+    if db.table_exists("tasks"):
+        return model.Task.select().count()
+    db.create_tables(models)
+    migrate(force=True)
+    return generate(args)
+
+
+def install_stubs():
+    import app
+    import harvest
+    import harvest_hours
+    import task_utils
+
+    def fzf(input, prompt=None):
+        return str(next(iter(input)))
+
+    app.fzf = fzf
+    app.fzf_with_query = lambda input, prompt=None: ("", str(next(iter(input))))
+    harvest.push_harvest_task = lambda data, uuid: None
+    harvest.get_user_id = lambda: "benchmark"
+    harvest.get_uploaded_uuids = lambda tasks, user_id: set()
+    harvest.pull_harvest_hours = lambda weeks: {week: 0.0 for week in weeks}
+    harvest_hours.refresh_in_background = lambda weeks: None
+    builtins.input = lambda prompt="": "Benchmark"
+    # The real one commits the benchmark's transaction while "waiting"
+    app.ask = task_utils.ask = lambda prompt="": "Benchmark"
+    app.QUIET = True
+
+
+def get_benchmarks():
+    import app
+    import export
+    import report
+    import search
+    import stats
+
+    return {
+        "task": app.print_day_summary,
+        "show_today": app.show_today_tasks,
+        "show_week": lambda: app.get_week_overview(),
+        "show_unlogged": app.show_unlogged_tasks,
+        "show_all_page": lambda: app.show_all_tasks(
+            since=date.today() - timedelta(days=365), limit=50, offset=100
+        ),
+        "get_weeks_tasks": lambda: list(app.get_weeks_tasks()),
+        "archive": app.archive_week,
+        "archive_all": lambda: app.archive_weeks(None, None),
+        "export": lambda: export.export_tasks(sys.stdout, "ndjson"),
+        "stats": stats.compute_stats,
+        "report": lambda: report.get_report(groups=["client", "project", "task"]),
+        "search": lambda: search.search_tasks("rev"),
+        "search_all": lambda: search.search_tasks("feature work", limit=None),
+        "log": app.log_tasks,
+        "push": lambda: (
+            app.queue_for_upload(app.get_unlogged_tasks()),
+            app.push_unlogged_tasks(),
+        ),
+        "assign": app.assign_task,
+        "start": app.start_new_task,
+        "preset_start": app.start_preset,
+    }
+
+
+def run_benchmark(fn, runs):
+    import tracing
+    from db_config import db
+
+    timings = []
+    for _ in range(runs):
+        # Roll back after each run, so that every run sees the same data
+        with db.atomic() as txn:
+            with open(os.devnull, "w") as devnull:
+                with contextlib.redirect_stdout(devnull), tracing.trace() as trace:
+                    start = time.perf_counter()
+                    fn()
+                    timings.append((time.perf_counter() - start) * 1000)
+            txn.rollback()
+    return {
+        "runs": runs,
+        "min_ms": round(min(timings), 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "max_ms": round(max(timings), 3),
+        "queries": trace.queries,
+    }
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as f:
+        baseline = json.load(f)["results"]
+    # `print` is silenced by the app's `-q` handling, write directly
+    sys.stdout.write(f"{'benchmark':<20}{'before':>12}{'after':>12}{'ratio':>8}\n")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["median_ms"]
+        after = result["median_ms"]
+        ratio = after / before if before else float("inf")
+        sys.stdout.write(f"{name:<20}{before:>10.2f}ms{after:>10.2f}ms{ratio:>7.2f}x\n")
+
+
+def main():
+    args = parse_args()
+    tmp = tempfile.TemporaryDirectory()
+    os.environ["TIMETRACK_DB"] = args.db or str(Path(tmp.name) / "timetrack.db")
+    os.environ["ARCHIVE_DIR"] = str(Path(tmp.name) / "archive")
+    os.environ["STATUSBAR_FILE"] = str(Path(tmp.name) / "statusbar")
+    for key in ("EMAIL", "HARVEST_TOKEN", "HARVEST_ACCOUNT_ID"):
+        os.environ.setdefault(key, "benchmark")
+    sys.path.insert(0, str(ROOT / "src"))
+
+    task_count = setup_database(args)
+    install_stubs()
+    benchmarks = get_benchmarks()
+    selected = args.benchmarks or list(benchmarks)
+    results = {}
+    over_budget = []
+    for name in selected:
+        result = run_benchmark(benchmarks[name], args.runs)
+        result["query_budget"] = QUERY_BUDGETS.get(name)
+        if result["query_budget"] and result["queries"] > result["query_budget"]:
+            over_budget.append(name)
+        results[name] = result
+        sys.stderr.write(
+            f"{name:<20}{result['median_ms']:>10.2f}ms{result['queries']:>6} queries\n"
+        )
+
+    report = {
+        "meta": {
+            "revision": get_git_revision(),
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "tasks": task_count,
+            "dataset": {
+                key: getattr(args, key)
+                for key in (
+                    "years",
+                    "tasks_per_day",
+                    "clients",
+                    "projects_per_client",
+                    "tasks_per_project",
+                    "presets",
+                    "unlogged_days",
+                    "seed",
+                )
+            },
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        sys.stdout.write(json.dumps(report, indent=2) + "\n")
+    if args.compare:
+        compare(results, args.compare)
+    tmp.cleanup()
+    for name in over_budget:
+        sys.stderr.write(
+            f"FAIL: {name} ran {results[name]['queries']} queries, "
+            f"budget is {results[name]['query_budget']}\n"
+        )
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
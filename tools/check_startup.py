@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Checks the import cost of a cold `task status`, see "Startup budget" in Doc.md.
+# Usage: python tools/check_startup.py [--budget-ms 150] [--runs 5] [-- COMMAND...]
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+APP = Path(__file__).resolve().parent.parent / "src" / "app.py"
+DEFAULT_BUDGET_MS = 150
+# Only commands that render or talk to Harvest may load these
+FORBIDDEN_MODULES = ["rich", "harvest", "pretty_print", "urllib.request", "http.client"]
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+
+def measure(command, db_path):
+    env = dict(os.environ, TIMETRACK_DB=db_path)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", str(APP), *command],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    total_us = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, module = match.groups()
+        modules.add(module)
+        if not indent:
+            total_us += int(cumulative)
+    return total_us / 1000, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the import cost of a cold `task` call"
+    )
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("command", nargs="*", default=["status"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "timetrack.db")
+        results = [measure(args.command, db_path) for _ in range(args.runs)]
+    best_ms = min(ms for ms, _ in results)
+    modules = set().union(*(modules for _, modules in results))
+    forbidden = [m for m in FORBIDDEN_MODULES if m in modules]
+
+    print(f"task {' '.join(args.command)}: {best_ms:.1f} ms of imports")
+    print(f"budget: {args.budget_ms:.1f} ms")
+    ok = True
+    if forbidden:
+        print(f"FAIL: loaded {', '.join(forbidden)}")
+        ok = False
+    if best_ms > args.budget_ms:
+        print("FAIL: over budget")
+        ok = False
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# Local stand-in for the parts of the Harvest API v2 that `task` uses, for
+# load/latency testing without a Harvest account:
+#
+#   python tools/fake_harvest.py --port 8765 --latency-ms 150 --error-rate 0.05
+#   HARVEST_BASE_URL=http://127.0.0.1:8765/v2 python src/app.py push
+#
+# State is kept in memory and lost on exit.
+
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.parse
+from collections import deque
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+USER_ID = 1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fake Harvest API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument(
+        "--error-rate", type=float, default=0, help="Share of requests failing (500)"
+    )
+    parser.add_argument(
+        "--lost-response-rate",
+        type=float,
+        default=0,
+        help="Share of created time entries whose response is dropped",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=100,
+        help="Requests per window before answering 429, 0 disables",
+    )
+    parser.add_argument("--rate-window", type=float, default=15)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--projects-per-client", type=int, default=5)
+    parser.add_argument("--tasks-per-project", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def to_timestamp(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class State:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.rng = random.Random(args.seed)
+        self.requests = deque()
+        self.time_entries = []
+        self.assignments = []
+        created = to_timestamp(datetime.now(timezone.utc) - timedelta(days=30))
+        for c in range(args.clients):
+            for p in range(args.projects_per_client):
+                projectId = 10000 + c * 100 + p
+                self.assignments.append(
+                    {
+                        "id": projectId,
+                        "is_active": True,
+                        "updated_at": created,
+                        "project": {"id": projectId, "name": f"Project {c}.{p}"},
+                        "client": {"id": 1000 + c, "name": f"Client {c}"},
+                        "task_assignments": [
+                            {
+                                "id": projectId * 100 + t,
+                                "is_active": True,
+                                "task": {"id": 100 + t, "name": f"Task {t}"},
+                            }
+                            for t in range(args.tasks_per_project)
+                        ],
+                    }
+                )
+
+    def is_rate_limited(self) -> float | None:
+        if not self.args.rate_limit:
+            return None
+        with self.lock:
+            now = time.monotonic()
+            while self.requests and now - self.requests[0] >= self.args.rate_window:
+                self.requests.popleft()
+            if len(self.requests) >= self.args.rate_limit:
+                return self.args.rate_window - (now - self.requests[0])
+            self.requests.append(now)
+            return None
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            return self.rng.random() < self.args.error_rate
+
+    def should_lose_response(self) -> bool:
+        with self.lock:
+            return self.rng.random() < self.args.lost_response_rate
+
+
+def paginate(items, key, query, path):
+    per_page = min(int(query.get("per_page", 100)), 2000)
+    page = int(query.get("page", 1))
+    total_pages = max(1, -(-len(items) // per_page))
+    next_page = page + 1 if page < total_pages else None
+    return {
+        key: items[(page - 1) * per_page : page * per_page],
+        "per_page": per_page,
+        "total_pages": total_pages,
+        "total_entries": len(items),
+        "page": page,
+        "next_page": next_page,
+        "previous_page": page - 1 if page > 1 else None,
+        "links": {
+            "next": f"{path}?page={next_page}&per_page={per_page}"
+            if next_page
+            else None
+        },
+    }
+
+
+def parse_date(value: str) -> date:
+    return datetime.strptime(value.replace("-", ""), "%Y%m%d").date()
+
+
+class Handler(BaseHTTPRequestHandler):
+    state: State
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, code: int, body: dict, headers: dict | None = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_request(self, method: str):
+        args = self.state.args
+        if args.latency_ms or args.jitter_ms:
+            jitter = random.uniform(-args.jitter_ms, args.jitter_ms)
+            time.sleep(max(0, args.latency_ms + jitter) / 1000)
+        retry_after = self.state.is_rate_limited()
+        if retry_after is not None:
+            self.send_json(
+                429,
+                {"message": "Too many requests"},
+                {"Retry-After": str(max(1, round(retry_after)))},
+            )
+            return
+        if self.state.should_fail():
+            self.send_json(500, {"message": "Injected failure"})
+            return
+
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        route = (method, url.path.removeprefix("/v2"))
+        match route:
+            case ("GET", "/users/me"):
+                self.send_json(200, {"id": USER_ID, "first_name": "Fake"})
+            case ("GET", "/users/me/project_assignments"):
+                assignments = self.state.assignments
+                if "updated_since" in query:
+                    since = query["updated_since"]
+                    assignments = [a for a in assignments if a["updated_at"] >= since]
+                self.send_json(
+                    200,
+                    paginate(assignments, "project_assignments", query, url.path),
+                )
+            case ("GET", "/reports/time/team"):
+                start = parse_date(query["from"])
+                end = parse_date(query["to"])
+                with self.state.lock:
+                    hours = sum(
+                        entry["hours"]
+                        for entry in self.state.time_entries
+                        if start <= parse_date(entry["spent_date"]) <= end
+                    )
+                results = [{"user_id": USER_ID, "total_hours": round(hours, 2)}]
+                self.send_json(200, {"results": results if hours else []})
+            case ("GET", "/time_entries"):
+                start = parse_date(query.get("from", "19700101"))
+                end = parse_date(query.get("to", "99991231"))
+                with self.state.lock:
+                    entries = [
+                        entry
+                        for entry in self.state.time_entries
+                        if start <= parse_date(entry["spent_date"]) <= end
+                    ]
+                self.send_json(200, paginate(entries, "time_entries", query, url.path))
+            case ("POST", "/time_entries"):
+                length = int(self.headers.get("Content-Length", 0))
+                form = dict(urllib.parse.parse_qsl(self.rfile.read(length).decode()))
+                with self.state.lock:
+                    entry = {
+                        "id": len(self.state.time_entries) + 1,
+                        "spent_date": form["spent_date"],
+                        "hours": float(form.get("hours", 0)),
+                        "notes": form.get("notes"),
+                        "project": {"id": int(form["project_id"])},
+                        "task": {"id": int(form["task_id"])},
+                        "external_reference": {
+                            "id": form["external_reference[id]"],
+                            "group_id": form.get("external_reference[group_id]"),
+                        }
+                        if "external_reference[id]" in form
+                        else None,
+                    }
+                    self.state.time_entries.append(entry)
+                if self.state.should_lose_response():
+                    # Created, but the client never learns about it
+                    self.close_connection = True
+                    return
+                self.send_json(201, entry)
+            case _:
+                self.send_json(404, {"message": "Not found"})
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+
+def main():
+    args = parse_args()
+    Handler.state = State(args)
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"Fake Harvest API on http://{args.host}:{args.port}/v2")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()